@@ -0,0 +1,113 @@
+'''Compares row access in SQLiteCache and MappedCache: random and
+   sequential get_one_row, 200-row get_rows blocks and get_counts,
+   in microseconds, and the size of each cache on disk.  Both caches
+   are written with the same synthetic PFAM rows through the Cache
+   writing hooks, as populating them from a session does; the
+   default of 142k match rows is the size of the PFAM table of a
+   wide proteome.
+
+   Usage: python benchmarks/bench_cache_backends.py [match rows]
+'''
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'iprstats')
+sys.path.insert(0, PACKAGE)
+
+import core
+
+ROWS = 142000
+BACKENDS = [core.SQLiteCache, core.MappedCache]
+
+def write_app(cache, app, rows):
+    '''Write rows matches of an app, with a count for every fourth
+       signature, and mark the app populated.
+    '''
+    rand = random.Random(rows)
+    signatures = max(1, rows // 4)
+    cache.writing = app
+    cache.__create_count_group__(app)
+    for n in xrange(signatures):
+        cache.__insert_count_record__(app, 'PFAM name %d' % n,
+                                      signatures - n)
+    cache.__create_match_group__(app)
+    for n in xrange(rows):
+        term = rand.randint(1, 5000)
+        cache.__insert_match_record__(app, 'PF%05d' % (n // 4),
+                                      'PFAM name %d' % (n // 4),
+                                      signatures - n // 4,
+                                      'GO:%07d' % term,
+                                      'GO term %d' % term)
+    cache.__commit_records__()
+    cache.__close_writing__()
+    cache.writing = None
+    cache.populated.add(app)
+
+def get_disk_size(path):
+    '''Returns: bytes taken up by a file or the files of a
+       directory (int)
+    '''
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum([os.path.getsize(os.path.join(path, name))
+                for name in os.listdir(path)])
+
+def time_per_call(calls, function):
+    '''Returns: microseconds per call of function over each item of
+       calls (float)
+    '''
+    started = time.time()
+    for args in calls:
+        function(*args)
+    return (time.time() - started) / max(1, len(calls)) * 1e6
+
+def measure(cache, app):
+    '''Returns: microseconds per random row, sequential row, row of
+       a 200-row block and get_counts call (tuple of float)
+    '''
+    length = cache.get_match_length(app)
+    rand = random.Random(1)
+    randomly = [(app, rand.randrange(length)) for n in xrange(100000)]
+    sequential = [(app, rownum) for rownum in xrange(length)]
+    blocks = [(app, start, min(start + 200, length))
+              for start in xrange(0, length, 200)]
+    block = time_per_call(blocks, cache.get_rows) * len(blocks) / length
+    return (time_per_call(randomly, cache.get_one_row),
+            time_per_call(sequential, cache.get_one_row), block,
+            time_per_call([(app, )] * 1000, cache.get_counts))
+
+def main(rows):
+    cwd = os.getcwd()
+    tempdir = tempfile.mkdtemp()
+    try:
+        shutil.copytree(os.path.join(PACKAGE, 'data'),
+                        os.path.join(tempdir, 'data'))
+        os.chdir(tempdir)
+        settings = core.Settings()
+        settings.apps = ['PFAM']
+        settings.newsession()
+        
+        print "%-12s %9s %9s %9s %9s %10s %8s" % (
+                    'backend', 'rows', 'random', 'sequence', 'block',
+                    'get_counts', 'disk')
+        for backend in BACKENDS:
+            cache = backend(settings)
+            write_app(cache, 'PFAM', rows)
+            cache = backend(settings)
+            timings = measure(cache, 'PFAM')
+            print "%-12s %9d %7.1fus %7.1fus %7.1fus %8.1fus %5.0f MB" % (
+                        (backend.__name__, cache.get_match_length('PFAM'))
+                        + timings + (get_disk_size(cache.filename) /
+                                     1048576.0, ))
+        settings.closesession()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tempdir, True)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else ROWS)
@@ -0,0 +1,78 @@
+'''Times a full-table walk of a SQLiteCache as the exporters do it,
+   get_one_row and two get_url calls for every row, on PFAM match
+   tables of 1k to 1M rows.  Rows are looked up by their ordinal,
+   so the time per row should stay flat as the table grows.
+
+   Usage: python benchmarks/bench_cache_rows.py [rows ...]
+'''
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'iprstats')
+sys.path.insert(0, PACKAGE)
+
+import core
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+def write_cache(settings, rows):
+    '''Write a results cache holding rows PFAM matches and as many
+       counts, which the cache opens as populated.
+    '''
+    conn = sqlite3.connect(os.path.join(settings.getsessiondir(),
+                                        core.SQLiteCache.cache_name))
+    tables = {'db':'', 'app':'PFAM'}
+    conn.execute(core.COUNTS_TABLE % tables)
+    conn.execute(core.MATCHES_TABLE % tables)
+    conn.executemany(
+        'insert into `PFAM_counts` ( `name`, `count` ) values (?, ?)',
+        (('PFAM name %d' % n, rows - n) for n in xrange(rows)))
+    conn.executemany(
+        'insert into `PFAM_matches` ( `name`, `count`, `goid`, `dbid`, '
+        '`goname` ) values (?, ?, ?, ?, ?)',
+        (('PFAM name %d' % n, rows - n, 'GO:%07d' % (n % 5000),
+          'PF%07d' % n, 'GO term %d' % (n % 5000)) for n in xrange(rows)))
+    conn.commit()
+    conn.close()
+
+def walk(cache, app):
+    '''Returns: seconds to read every row of an app with its links
+       (float)
+    '''
+    started = time.time()
+    for rownum in xrange(cache.get_match_length(app)):
+        cache.get_one_row(app, rownum)
+        cache.get_url(app, rownum)
+        cache.get_url(app, rownum, True)
+    return time.time() - started
+
+def main(sizes):
+    cwd = os.getcwd()
+    tempdir = tempfile.mkdtemp()
+    try:
+        shutil.copytree(os.path.join(PACKAGE, 'data'),
+                        os.path.join(tempdir, 'data'))
+        os.chdir(tempdir)
+        settings = core.Settings()
+        settings.apps = ['PFAM']
+        
+        print "%10s %10s %10s" % ('rows', 'seconds', 'us/row')
+        for rows in sizes:
+            settings.newsession()
+            write_cache(settings, rows)
+            cache = core.SQLiteCache(settings)
+            elapsed = walk(cache, 'PFAM')
+            print "%10d %10.2f %10.1f" % (rows, elapsed,
+                                          elapsed / rows * 1e6)
+        settings.closesession()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tempdir, True)
+
+if __name__ == '__main__':
+    main([int(rows) for rows in sys.argv[1:]] or SIZES)
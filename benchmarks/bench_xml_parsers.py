@@ -0,0 +1,118 @@
+'''Compares the 'sax' and 'iterparse' XML parser backends on
+   synthetic InterProScan XML files of 10k to 1M proteins: elements
+   parsed per second and peak resident memory.  Rows are parsed by
+   EBIXML and discarded, so only the parse is timed.  Each parse
+   runs in its own process, so that its peak memory is its own.
+
+   Usage: python benchmarks/bench_xml_parsers.py [proteins ...]
+'''
+import os
+import sys
+import time
+import random
+import shutil
+import resource
+import tempfile
+import subprocess
+
+PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'iprstats')
+sys.path.insert(0, PACKAGE)
+
+import importers
+
+SIZES = [10000, 100000, 1000000]
+BACKENDS = ['sax', 'iterparse']
+MATCH_DBS = [('PFAM', 'PF%05d', 'HMMPfam'),
+             ('PRINTS', 'PR%05d', 'FPrintScan'),
+             ('SMART', 'SM%05d', 'HMMSmart'),
+             ('GENE3D', 'G3DSA:%d', 'Gene3D')]
+
+class RowDiscarder(importers.RowCollector):
+    '''Writer that drops the parsed rows.
+    '''
+    
+    def add(self, table, row):
+        pass
+
+def write_xml(filename, proteins):
+    '''Write an InterProScan XML file with proteins proteins of one
+       to three InterPro entries each.
+       Returns: number of elements written (int)
+    '''
+    rand = random.Random(proteins)
+    xmlfile = open(filename, 'w')
+    xmlfile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<interpro_matches>\n')
+    elements = 1
+    for n in xrange(proteins):
+        lines = [' <protein id="P%07d" length="%d" crc64="%016X">' %
+                 (n, 100 + n % 50, n * 7919)]
+        for ipr in rand.sample(xrange(1, 40), rand.randint(1, 3)):
+            lines.append('  <interpro id="IPR%06d" name="Entry %d" '
+                         'type="Domain">' % (ipr, ipr))
+            for match in xrange(rand.randint(1, 2)):
+                db, acc, evidence = rand.choice(MATCH_DBS)
+                number = rand.randint(1, 30)
+                lines.append('   <match id="%s" name="%s name %d" '
+                             'dbname="%s">' % (acc % number, db, number, db))
+                for location in xrange(rand.randint(1, 2)):
+                    lines.append('    <location start="%d" end="%d" '
+                                 'score="1e-5" status="T" evidence="%s" />'
+                                 % (location * 10 + 1, location * 10 + 9,
+                                    evidence))
+                    elements += 1
+                lines.append('   </match>')
+                elements += 1
+            for term in xrange(rand.randint(0, 2)):
+                lines.append('   <classification id="GO:%07d" '
+                             'class_type="GO"><category>Molecular '
+                             'Function</category></classification>' %
+                             rand.randint(1, 25))
+                elements += 2
+            lines.append('  </interpro>')
+            elements += 1
+        lines.append(' </protein>')
+        elements += 1
+        xmlfile.write('\n'.join(lines) + '\n')
+    xmlfile.write('</interpro_matches>\n')
+    xmlfile.close()
+    return elements
+
+def parse(filename, backend):
+    '''Parse a file with a backend in this process and print the
+       seconds taken and the peak resident memory in kB.
+    '''
+    started = time.time()
+    importers.parse_xml(filename, importers.EBIXML(None,
+                        writer=RowDiscarder()), backend)
+    elapsed = time.time() - started
+    print elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def main(sizes):
+    tempdir = tempfile.mkdtemp()
+    try:
+        print "%9s %11s %-10s %12s %10s" % ('proteins', 'elements',
+                                            'backend', 'elements/s',
+                                            'peak RSS')
+        for proteins in sizes:
+            filename = os.path.join(tempdir, 'proteins.xml')
+            elements = write_xml(filename, proteins)
+            for backend in BACKENDS:
+                output = subprocess.Popen([sys.executable, __file__,
+                                           '--parse', filename, backend],
+                                          stdout=subprocess.PIPE
+                                          ).communicate()[0]
+                elapsed, maxrss = output.split()[-2:]
+                print "%9d %11d %-10s %12.0f %7d MB" % (
+                            proteins, elements, backend,
+                            elements / float(elapsed), int(maxrss) // 1024)
+            os.remove(filename)
+    finally:
+        shutil.rmtree(tempdir, True)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--parse']:
+        parse(sys.argv[2], sys.argv[3])
+    else:
+        main([int(proteins) for proteins in sys.argv[1:]] or SIZES)
@@ -1,6 +1,17 @@
 #!/usr/bin/python
 import os
+import time
+import mmap
+import array
+import struct
 import sqlite3
+import hashlib
+import Queue
+from itertools import groupby, izip
+from operator import itemgetter
+from threading import Thread, Lock, local
+
+import importers
 
 try:
     import MySQLdb
@@ -8,12 +19,24 @@ try:
 except ImportError:
     pass
 
+# Attributes of a Cache holding database connections and cursors.  A
+# SQLite connection only works in the thread that opened it, so each
+# thread reading or populating the cache opens its own.
+CONNECTIONS = ('db_conn', 'db_cursor', 'go_conn', 'go_cursor',
+               'conn', 'cache_cursor')
+
 class Cache:
     '''Object to temporarily store aggregate information retrieved
        by complex, time-intensive queries. This is the top-level class
        that stores all information in memory.  Subclasses of this
        class should attempt to preserve memory by caching to disk.
        
+       The groups of an app are populated the first time its rows or
+       counts are asked for, or together with other apps by
+       populate_apps, as a ResultsLoader does in the background.
+       While the groups of an app are written, self.writing is the
+       name of the app.
+       
        Methods you are required to override when making a subclass are:
        __open_cache__(self)
        __create_count_group__(self, app)
@@ -24,20 +47,31 @@ class Cache:
        get_counts(self, app)
        
        It is also recommended to override the following methods:
+       __connect_cache__(self)
        __commit_records__(self)
        __close_writing__(self)
     '''
     
+    # Name of the file or directory in the session directory
+    # that holds the cache; None for caches kept in memory only
+    cache_name = None
+    
     def __init__(self, settings):
         '''Initialize the cache object with a settings object in order
            for it to get a database connection and the working session
            directory.
         '''
         self.settings = settings
-        self.filename = os.path.join(self.settings.getsessiondir(), 'results')
-        self.db_conn = self.__get_db_conn__()
-        self.db_cursor = self.db_conn.cursor()
-        self.go_conn, self.go_cursor = self.__get_go_db_conn__()
+        self.threads = local()
+        self.lock = Lock()
+        self.populated = set()
+        self.prepared = False
+        self.writing = None
+        self.filename = None
+        if self.cache_name:
+            self.filename = os.path.join(self.settings.getsessiondir(),
+                                         self.cache_name)
+        self.gonames = {}
         
         # Hash of database links
         self.linkdb = {
@@ -61,10 +95,47 @@ class Cache:
             'GENE3D'     :'http://www.cathdb.info/gene3d/%s',
             'GO'         :'http://www.ebi.ac.uk/QuickGO/GTerm?id=%s#ancchart'}
         
-        if not os.path.exists(self.filename):
-            self.__populate_cache__()
+        self.__open_cache__()
+    
+    def __getattr__(self, name):
+        '''Look up the database connections and cursors of the
+           calling thread, opening them the first time it asks.
+        '''
+        if name not in CONNECTIONS:
+            raise AttributeError, name
+        if not hasattr(self.threads, name):
+            if name in ('db_conn', 'db_cursor'):
+                self.db_conn = self.__get_db_conn__()
+                self.db_cursor = self.db_conn.cursor()
+            elif name in ('go_conn', 'go_cursor'):
+                self.go_conn, self.go_cursor = self.__get_go_db_conn__()
+            else:
+                self.__connect_cache__()
+        return getattr(self.threads, name)
+    
+    def __setattr__(self, name, value):
+        if name in CONNECTIONS:
+            setattr(self.threads, name, value)
         else:
-            self.__open_cache__()
+            self.__dict__[name] = value
+    
+    def __connect_cache__(self):
+        '''Open the connection and cursor of the calling thread to
+           the underlying data structure, for subclasses that store
+           it in a database.
+        '''
+        self.conn = None
+        self.cache_cursor = None
+    
+    def close_connections(self):
+        '''Close the session and GO database connections of the
+           calling thread, once it is done populating the cache.
+        '''
+        for name in ('db_cursor', 'db_conn', 'go_cursor', 'go_conn'):
+            if getattr(self.threads, name, None):
+                getattr(self.threads, name).close()
+            if hasattr(self.threads, name):
+                delattr(self.threads, name)
     
     def __get_db_conn__(self):
         '''Attempt to get a database connection (either MySQL or SQLite
@@ -98,7 +169,10 @@ class Cache:
         if self.settings.usegolookup():
             dbs=self.settings.getgodb()
             try:
-                db_conn = self.__get_mysql_conn__(dbs)
+                if self.settings.getgobackend() == 'local':
+                    db_conn = self.__get_go_index_conn__()
+                else:
+                    db_conn = self.__get_mysql_conn__(dbs)
                 db_cursor = db_conn.cursor()
             except:
                 print 'Cannot connect to GO DB... disabling GO lookup'
@@ -108,6 +182,21 @@ class Cache:
             return db_conn, db_cursor
         return None, None
         
+    def __get_go_index_conn__(self):
+        '''Open the local GO term index, (re)building it first when
+           the 'obo_file' setting names a term file newer than the
+           index.  Raises an IOError if there is no index.
+        '''
+        indexpath = self.settings.getgoindex()
+        obofile = self.settings.getgoobofile()
+        if obofile and os.path.exists(obofile) and \
+                (not os.path.exists(indexpath) or
+                 os.path.getmtime(indexpath) < os.path.getmtime(obofile)):
+            importers.build_go_index(obofile, indexpath)
+        if not os.path.exists(indexpath):
+            raise IOError, "No GO term index: " + indexpath
+        return sqlite3.connect(indexpath)
+    
     def __get_mysql_conn__(self, dbsettings):
         '''Generic class for retrieving a MySQL connection object
            given a DBSettings object.
@@ -119,54 +208,144 @@ class Cache:
                                db=dbsettings.getdb())
         return conn
     
-    def __populate_cache__(self):
-        '''Main method for executing queries against the IPRStats
-           database and storing them in memory or on disk.
-        '''
-        self.__open_cache__()
+    def populate(self, app):
+        '''Populate the count and match groups of an app unless
+           they have been already.
+        '''
+        if app in self.populated or app not in self.settings.apps:
+            return
+        self.populate_apps([app])
+    
+    def populate_apps(self, apps):
+        '''Populate the count and match groups of the given apps
+           that have not been already, with one pass of the count
+           and match queries over all of them.  Apps are populated
+           by one thread at a time; a thread asking for an app that
+           another thread is populating waits for it.
+        '''
+        self.lock.acquire()
+        try:
+            apps = [app for app in apps if app in self.settings.apps and
+                                           app not in self.populated]
+            if apps:
+                start = time.time()
+                self.__populate_apps__(apps)
+                self.populated.update(apps)
+                print "Results cache: %s populated in %.2fs" % (
+                            ', '.join(apps), time.time() - start)
+        finally:
+            self.lock.release()
+        if len(self.populated) == len(self.settings.apps):
+            self.close_connections()
+    
+    def __prepare__(self):
+        '''Upgrade the session tables and resolve the names of all
+           GO terms in bulk, once, before the first app is populated.
+        '''
+        if self.prepared:
+            return
+        importers.upgrade_schema(self.db_conn, self.settings.getsession())
+        if self.settings.usegolookup() and self.go_conn:
+            self.__go_query__()
+            self.gonames = self.__go_names__(
+                                [goid for (goid, ) in self.db_cursor])
+        self.prepared = True
+    
+    def __populate_apps__(self, apps):
+        '''Main method for executing the queries of the given apps
+           against the IPRStats database and storing them in memory
+           or on disk.  The rows of both queries come app by app,
+           in the same order, so the groups of each app are written
+           and closed in turn.
+        '''
+        self.__prepare__()
         
-        for app in self.settings.apps:
-            self.__count_query__(app)
+        # The count rows are read while the match query runs on a
+        # second cursor; both queries group the same rows by app
+        self.__count_query__(apps)
+        counts = groupby(self.db_cursor, itemgetter(0))
+        self.db_cursor = self.db_conn.cursor()
+        self.__match_query__(apps)
+        matches = groupby(self.db_cursor, itemgetter(0))
+        
+        empty = list(apps)
+        for (app, count_rows), (_, match_rows) in izip(counts, matches):
+            self.writing = app
             self.__create_count_group__(app)
-            for name, count in self.db_cursor:
+            for app, name, count in count_rows:
                 self.__insert_count_record__(app, name, count)
-            self.__commit_records__()
-                
-            self.__match_query__(app)
+            
             self.__create_match_group__(app)
-            for name, dbid, goid, count in self.db_cursor:
+            for app, name, dbid, goid, count in match_rows:
                 if self.settings.usegolookup():
                     goname = self.__go_name__(goid)
                 else: goname = None
-                self.__insert_match_record__(app, dbid, name, count, goid, goname)
-                
+                self.__insert_match_record__(app, dbid, name, count,
+                                             goid, goname)
             self.__commit_records__()
+            
+            self.__close_writing__()
+            empty.remove(app)
         
-        self.__close_writing__()
-        self.db_cursor.close()
-        if self.go_cursor:
-            self.go_cursor.close()
+        # Apps without any matches
+        for app in empty:
+            self.writing = app
+            self.__create_count_group__(app)
+            self.__create_match_group__(app)
+            self.__commit_records__()
+            self.__close_writing__()
+        self.writing = None
     
     def __open_cache__(self):
         '''Method for creating the underlying data structure
            for storing query results.  Subclasses must override
            this method to open handles to disk-based structures
-           or create memory maps.
+           or create memory maps, and to add the apps whose groups
+           are complete to self.populated.
         '''
         self.table = {}
         self.count = {}
     
-    def __count_query__(self, app):
+    def __count_query__(self, apps):
         '''Method for executing the query used to retrieve
-           information for making charts.
+           information for making charts for all the given apps.
+           Rows are (app, name, count), ordered by count within
+           each app.
         '''
+        codes, decode = self.__app_codes__(apps)
         self.db_cursor.execute("""
-            select   name, count(1) as count
+            select   %(app)s, name, count(1) as count
             from     `%(session)s_iprmatch`
-            where    db_name = '%(db)s'
-            group by id
-            order by count desc, name asc""" %
-            ({'session':self.settings.session, 'db':app}))
+            where    db_name in (%(codes)s)
+            group by db_name, match_key
+            order by db_name, count desc, name asc""" %
+            ({'session':self.settings.session, 'codes':codes,
+              'app':decode % {'column':'db_name'}}))
+    
+    def __in_list__(self, apps):
+        '''Returns: apps quoted for an SQL "in" list (str)
+        '''
+        return ', '.join(["'%s'" % (app) for app in apps]) or 'NULL'
+    
+    def __app_codes__(self, apps):
+        '''Look up the dictionary codes the session stores the
+           given app names (db_name) as, so queries can filter on
+           the codes and decode them to app names in the select.
+           Returns: (SQL "in" list of the codes, SQL expression with
+                    a %(column)s placeholder that decodes a code to
+                    its app name) (tuple of str)
+        '''
+        self.db_cursor.execute("""
+            select code, value
+            from   `%s_dictionary`
+            where  value in (%s)""" %
+            (self.settings.session, self.__in_list__(apps)))
+        codes = self.db_cursor.fetchall()
+        if not codes:
+            return 'NULL', 'NULL'
+        return (', '.join([str(code) for code, _ in codes]),
+                'case %(column)s ' + ' '.join(["when %d then '%s'" %
+                     (code, app) for code, app in codes]) + ' end')
     
     def __create_count_group__(self, app):
         '''Method used for creating a group or section in
@@ -184,25 +363,33 @@ class Cache:
         '''
         self.count[app].append((count, name))
         
-    def __match_query__(self, app):
+    def __match_query__(self, apps):
         '''Method for executing the query that retrieves table
-           data from the IPRStats database.
+           data from the IPRStats database for all the given apps.
+           Rows are (app, name, dbid, goid, count), ordered by
+           count within each app.  The match ids are looked up by
+           their keys once the rows have been grouped.
         '''
+        codes, decode = self.__app_codes__(apps)
         self.db_cursor.execute("""
-            select   A.name, B.match_id, C.class_id, A.count
-            from     ( select   name, pim_id, count(1) as count
+            select   %(app)s, A.name,
+                     ( select match_id
+                       from   `%(session)s_match`
+                       where  match_key = B.match_key ),
+                     C.class_id, A.count
+            from     ( select   db_name, name, pim_id, count(1) as count
                        from     `%(session)s_iprmatch`
-                       where    db_name = '%(db)s'
-                       group by id
-                       order by count desc, id asc, name asc
+                       where    db_name in (%(codes)s)
+                       group by db_name, match_key
                      ) as A
                      left outer join `%(session)s_protein_interpro_match` 
                        as B on A.pim_id = B.pim_id
                      left outer join `%(session)s_protein_classification`
-                       as C on B.protein_id = C.protein_id
-            group by B.match_id, C.class_id
-            order by A.count desc, A.name asc;""" %
-            ({'session':self.settings.session, 'db':app}))
+                       as C on B.protein_key = C.protein_key
+            group by A.db_name, B.match_key, C.class_id
+            order by A.db_name, A.count desc, A.name asc;""" %
+            ({'session':self.settings.session, 'codes':codes,
+              'app':decode % {'column':'A.db_name'}}))
     
     def __create_match_group__(self, app):
         '''Method used for creating a group or section in
@@ -227,8 +414,9 @@ class Cache:
         pass
     
     def __close_writing__(self):
-        '''Method for closing the underlying data structure
-           for writing and opening it for reading.
+        '''Method for closing the groups of the app being
+           written (self.writing) in the underlying data
+           structure for writing and opening them for reading.
         '''
         pass
     
@@ -243,6 +431,7 @@ class Cache:
            table data, limited by the "max table results"
            setting or the number of available table rows.
         '''
+        self.populate(app)
         matchlen = self.__match_length__(app)
         maxtablelen = self.settings.getmaxtableresults()
         if maxtablelen < 0:
@@ -254,6 +443,7 @@ class Cache:
            in a graph, limited either by the "max chart
            results" setting or the number of available results.
         '''
+        self.populate(app)
         countlen = self.__count_length__(app)
         maxchartlen = self.settings.chart.getmaxresults()
         if maxchartlen < 0:
@@ -267,6 +457,7 @@ class Cache:
            
            Returns (dbname, count, goid, dbid, goname)
         '''
+        self.populate(app)
         if app in self.settings.apps:
             return self.table[app][rownum]
         else:
@@ -289,7 +480,13 @@ class Cache:
         row = self.get_one_row(app, rownum)
         
         if not row: return None
-        elif go_link: id = row[2]
+        return self.__get_link__(app, row, go_link)
+    
+    def __get_link__(self, app, row, go_link=False):
+        '''Returns: the app or gene ontology URL of a table
+           data row, or None (str)
+        '''
+        if go_link: id = row[2]
         else: id = row[3]
         
         if id != None and app in self.linkdb.keys() and not go_link:
@@ -299,19 +496,183 @@ class Cache:
         else:
             return None
     
+    def get_rows(self, app, start, stop):
+        '''Return the table data rows start to stop (exclusive)
+           for the specified app, each followed by its app and
+           gene ontology URLs.  Rows past the end of the table
+           are left out; callers should stay within
+           get_match_length().
+           
+           Returns [(dbname, count, goid, dbid, goname, url, gourl),
+                    ...]
+        '''
+        self.populate(app)
+        if app in self.settings.apps:
+            return [tuple(row) + (self.__get_link__(app, row),
+                                  self.__get_link__(app, row, True))
+                    for row in self.__get_rows__(app, start, stop)]
+        else:
+            return []
+    
+    def __get_rows__(self, app, start, stop):
+        '''Return table data rows start to stop (exclusive) from
+           the underlying data structure.  Subclasses should
+           override this to read the rows in one request.
+        '''
+        return self.table[app][start:stop]
+    
+    def iter_rows(self, app, chunk_size=1000):
+        '''Iterate over the visible table data rows of the
+           specified app in the format of get_rows(), reading
+           chunk_size rows at a time.
+        '''
+        length = self.get_match_length(app)
+        for start in xrange(0, length, chunk_size):
+            for row in self.get_rows(app, start,
+                                     min(start + chunk_size, length)):
+                yield row
+    
+    def __go_query__(self):
+        '''Method for executing the query that retrieves the
+           distinct classification (GO term) ids of the session.
+        '''
+        self.db_cursor.execute("""
+            select   distinct class_id
+            from     `%(session)s_protein_classification`""" %
+            ({'session':self.settings.session}))
+    
     def __go_name__(self, go_id):
         '''Retrieve the gene ontology name for the given
            term id. This should only be called if GO lookup
-           is set to True.
+           is set to True.  Names resolved in bulk by
+           __go_names__ are used without another query.
         '''
-        self.go_cursor.execute(
-            'select name, term_definition from `term` join `term_definition`' + \
-            ' on id = term_id where acc = "%s"' % (go_id))
+        if go_id is None:
+            return None
+        elif go_id in self.gonames:
+            return self.gonames[go_id]
+        
+        self.go_cursor.execute(self.__go_terms_sql__(1), (go_id, ))
         goinfo = self.go_cursor.fetchone()
         
-        if goinfo: return goinfo[0]
+        if goinfo: return goinfo[1]
         else: return None
     
+    def __go_terms_sql__(self, count):
+        '''Returns: the query selecting (acc, name) of count GO term
+           ids from the GO backend in use (str)
+        '''
+        if self.settings.getgobackend() == 'local':
+            return 'select acc, name from `%s` where acc in (%s)' % \
+                   (importers.GO_INDEX_TABLE, ', '.join(['?'] * count))
+        return 'select acc, name from `term` join `term_definition`' + \
+               ' on id = term_id where acc in (%s)' % \
+               ', '.join(['%s'] * count)
+    
+    def __go_names__(self, go_ids):
+        '''Retrieve the gene ontology names for many term ids
+           with batched "in (...)" queries, spread over up to
+           'connections' GO database connections in parallel.  The
+           local GO term index is read from this thread only.
+           Terms whose batch could not be looked up, e.g. because the
+           GO server failed, are left out, so that __go_name__ looks
+           them up one at a time.
+           This should only be called if GO lookup is set to True.
+           Returns: {term id: name or None if not found} (dict)
+        '''
+        go_ids = sorted(set([go_id for go_id in go_ids if go_id]))
+        
+        # Only the terms missing from the persistent GO name
+        # cache are looked up in the GO database
+        namecache = self.__get_go_name_cache__()
+        cached = {}
+        if namecache:
+            cached = namecache.lookup(go_ids)
+            go_ids = [go_id for go_id in go_ids if go_id not in cached]
+        
+        local = self.settings.getgobackend() == 'local'
+        size = max(1, self.settings.getgobatchsize())
+        if local: # SQLite allows at most 999 query parameters
+            size = min(size, 999)
+        batches = Queue.Queue()
+        for start in xrange(0, len(go_ids), size):
+            batches.put(go_ids[start:start + size])
+        
+        conns = [self.go_conn]
+        dbs = self.settings.getgodb()
+        while not local and len(conns) < min(
+                self.settings.getgoconnections(), batches.qsize()):
+            try:
+                conns.append(self.__get_mysql_conn__(dbs))
+            except:
+                break
+        
+        names = {}
+        resolved = []
+        errors = []
+        def resolve(conn):
+            # A connection that fails hands its batch back to the
+            # others and stops
+            batch = None
+            try:
+                cursor = conn.cursor()
+                while True:
+                    try:
+                        batch = batches.get_nowait()
+                    except Queue.Empty:
+                        break
+                    cursor.execute(self.__go_terms_sql__(len(batch)), batch)
+                    for acc, name in cursor.fetchall():
+                        names[acc] = name
+                    resolved.extend(batch)
+                    batch = None
+                cursor.close()
+            except Exception, e:
+                errors.append(e)
+                if batch:
+                    batches.put(batch)
+        
+        if local:
+            resolve(self.go_conn)
+        else:
+            workers = [Thread(target=resolve, args=(conn, ))
+                       for conn in conns]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        for conn in conns[1:]:
+            try: conn.close()
+            except: pass
+        if len(resolved) < len(go_ids):
+            print "GO lookup failed for %d of %d terms: %s" % (
+                        len(go_ids) - len(resolved), len(go_ids), errors[0])
+        
+        # Remember the terms that were looked up but not found as well
+        found = {}
+        for go_id in resolved:
+            found[go_id] = names.get(go_id)
+        if namecache:
+            namecache.store(found)
+            namecache.close()
+        found.update(cached)
+        return found
+    
+    def __get_go_name_cache__(self):
+        '''Open the persistent GO name cache shared by all
+           sessions, unless it is disabled in the settings.
+           Returns: GONameCache or None
+        '''
+        filename = self.settings.getgonamecache()
+        if not filename:
+            return None
+        try:
+            return GONameCache(filename, self.settings.getgonamecachesize(),
+                               self.settings.getgonamecachedays())
+        except sqlite3.Error, e:
+            print "Cannot open GO name cache '%s': %s" % (filename, e)
+            return None
+    
     def get_counts(self, app):
         '''Retrieve an array of data for chart generation.
            Returns [(value1, value2, ...), (label1, label2, ...)]
@@ -319,6 +680,7 @@ class Cache:
            to retrieve the data from the underlying structure
            and return it in the specified format.
         '''
+        self.populate(app)
         if app in self.settings.apps:
             counts = [self.count[app][n] for n in \
                       range(self.get_count_length(app))]
@@ -330,30 +692,175 @@ class Cache:
         else:
             return [None, None]
 
+# Tables of the SQLiteCache, with a %(db)s placeholder for the name
+# of the database they are created in when it is attached
+COUNTS_TABLE = """
+                CREATE TABLE %(db)s`%(app)s_counts`
+                    ( `rownum` integer PRIMARY KEY,
+                      `name` varchar(2048) NOT NULL,
+                      `count` int(10) DEFAULT NULL,
+                UNIQUE (`name`) );"""
+MATCHES_TABLE = """
+                CREATE TABLE %(db)s`%(app)s_matches`
+                    ( `rownum` integer PRIMARY KEY,
+                      `name` varchar(2048) NOT NULL,
+                      `count` int(10) DEFAULT NULL,
+                      `goid` varchar(10) DEFAULT NULL,
+                      `dbid` varchar(16) NOT NULL,
+                      `goname` varchar(1024) DEFAULT NULL,
+                UNIQUE (`dbid`,`goid`) );"""
+
 class SQLiteCache(Cache):
     '''Subclass of Cache that uses a SQLite database to
        store the results of the MySQL query.
+       
+       Rows are numbered by a dense `rownum` ordinal (the
+       table's rowid) in the order the queries return them,
+       so row lookups are a primary key search instead of
+       a LIMIT/OFFSET scan.  Caches written before the
+       column existed have the same rowids, since their
+       rows were only ever appended.
+       
+       When the session itself is a SQLite database the
+       cache is built inside SQLite: the cache file is
+       attached to the session connection and each table is
+       filled by one INSERT ... SELECT.  Missing values are
+       stored as the string 'None', as the row-by-row
+       inserts of MySQL sessions store them.
     '''
     
+    cache_name = 'results'
+    
     def __init__(self, settings):
         Cache.__init__(self, settings)
     
+    def __populate_apps__(self, apps):
+        '''Build the cache tables of the given apps with INSERT ...
+           SELECT statements run by the SQLite session database, with
+           the cache file attached once for all of them; only the GO
+           term names are looked up in Python, into a temporary table
+           the statements join.  MySQL sessions are cached row by row
+           by Cache.__populate_apps__.
+        '''
+        if not isinstance(self.db_conn, sqlite3.Connection):
+            Cache.__populate_apps__(self, apps)
+            return
+        
+        self.__prepare__()
+        session = self.settings.getsession()
+        self.db_cursor.execute("ATTACH DATABASE ? AS `results`",
+                               (self.filename, ))
+        try:
+            self.db_cursor.execute("DROP TABLE IF EXISTS temp.`go_name`")
+            self.db_cursor.execute("""
+                    CREATE TEMP TABLE `go_name`
+                        ( `acc` varchar(10) PRIMARY KEY,
+                          `name` varchar(1024) NOT NULL );""")
+            self.db_cursor.executemany(
+                    'insert into temp.`go_name` values (?, ?)',
+                    [item for item in self.gonames.iteritems() if item[1]])
+            
+            for app in apps:
+                self.__insert_app__(app, session)
+                self.db_conn.commit()
+        finally:
+            # Leave nothing attached to this thread's connection if
+            # a statement failed, or the next app could not attach
+            self.db_conn.rollback()
+            self.db_cursor.execute("DETACH DATABASE `results`")
+    
+    def __insert_app__(self, app, session):
+        '''Fill the cache tables of an app, in the attached cache
+           file, from the session tables and mark it populated.
+        '''
+        self.db_cursor.execute("""
+                select code
+                from   `%s_dictionary`
+                where  value = ?""" % (session), (app, ))
+        code = self.db_cursor.fetchone()
+        tables = {'db':'`results`.', 'app':app, 'session':session,
+                  'code':code and code[0] or 'NULL'}
+        self.db_cursor.execute(
+                "DROP TABLE IF EXISTS %(db)s`%(app)s_counts`" % tables)
+        self.db_cursor.execute(COUNTS_TABLE % tables)
+        self.db_cursor.execute("""
+                insert or ignore into `results`.`%(app)s_counts`
+                         ( `name`, `count` )
+                select   name, count(1) as count
+                from     `%(session)s_iprmatch`
+                where    db_name = %(code)s
+                group by match_key
+                order by count desc, name asc""" % tables)
+        
+        self.db_cursor.execute(
+                "DROP TABLE IF EXISTS %(db)s`%(app)s_matches`" % tables)
+        self.db_cursor.execute(MATCHES_TABLE % tables)
+        self.db_cursor.execute("""
+                insert or ignore into `results`.`%(app)s_matches`
+                         ( `name`, `count`, `goid`, `dbid`, `goname` )
+                select   A.name, A.count, coalesce(C.class_id, 'None'),
+                         coalesce(( select match_id
+                                    from   `%(session)s_match`
+                                    where  match_key = B.match_key ),
+                                  'None'),
+                         coalesce(( select name
+                                    from   temp.`go_name`
+                                    where  acc = C.class_id ), 'None')
+                from     ( select   name, pim_id, count(1) as count
+                           from     `%(session)s_iprmatch`
+                           where    db_name = %(code)s
+                           group by match_key
+                         ) as A
+                         left outer join
+                           `%(session)s_protein_interpro_match`
+                           as B on A.pim_id = B.pim_id
+                         left outer join
+                           `%(session)s_protein_classification`
+                           as C on B.protein_key = C.protein_key
+                group by B.match_key, C.class_id
+                order by A.count desc, A.name asc""" % tables)
+        self.db_cursor.execute(
+                "insert into `results`.`populated` values (?)", (app, ))
+    
     def __open_cache__(self):
-        '''Open a connection and cursor to the SQLite
-           database located at self.filename
+        '''Open the SQLite database located at self.filename and
+           find the apps whose tables are complete.  Caches written
+           before the apps were populated on demand were complete
+           once the file existed.
         '''
-        self.conn = sqlite3.connect(self.filename)
+        existed = os.path.exists(self.filename)
+        self.cache_cursor.execute("""
+                select name
+                from   sqlite_master
+                where  type = 'table'""")
+        tables = set([name for (name, ) in self.cache_cursor])
+        if 'populated' not in tables:
+            self.cache_cursor.execute("""
+                CREATE TABLE `populated`
+                    ( `app` varchar(80) PRIMARY KEY );""")
+            if existed:
+                self.cache_cursor.executemany(
+                    'insert into `populated` values (?)',
+                    [(app, ) for app in self.settings.apps
+                     if app + '_counts' in tables and
+                        app + '_matches' in tables])
+            self.conn.commit()
+        self.cache_cursor.execute('select app from `populated`')
+        self.populated.update([app for (app, ) in self.cache_cursor])
+    
+    def __connect_cache__(self):
+        '''Open a connection and cursor of the calling thread
+           to the SQLite database located at self.filename
+        '''
+        self.conn = sqlite3.connect(self.filename, timeout=60)
         self.cache_cursor = self.conn.cursor()
     
     def __create_count_group__(self, app):
         '''Create a group (table) in the open SQLite
            database for storing count query results.
         '''
-        self.cache_cursor.execute("""
-                CREATE TABLE `%s_counts`
-                    ( `name` varchar(2048) NOT NULL,
-                      `count` int(10) DEFAULT NULL,
-                PRIMARY KEY (`name`) );""" % (app))
+        self.cache_cursor.execute("DROP TABLE IF EXISTS `%s_counts`" % (app))
+        self.cache_cursor.execute(COUNTS_TABLE % {'db':'', 'app':app})
     
     def __insert_count_record__(self, app, name, count):
         '''Insert a record retrieved by the MySQL query
@@ -369,14 +876,8 @@ class SQLiteCache(Cache):
         '''Create a group (table) in the open SQLite
            database for storing match query results.
         '''
-        self.cache_cursor.execute("""
-                CREATE TABLE `%s_matches`
-                    ( `name` varchar(2048) NOT NULL,
-                      `count` int(10) DEFAULT NULL,
-                      `goid` varchar(10) DEFAULT NULL,
-                      `dbid` varchar(16) NOT NULL,
-                      `goname` varchar(1024) DEFAULT NULL,
-                PRIMARY KEY (`dbid`,`goid`) );""" % (app))
+        self.cache_cursor.execute("DROP TABLE IF EXISTS `%s_matches`" % (app))
+        self.cache_cursor.execute(MATCHES_TABLE % {'db':'', 'app':app})
     
     def __insert_match_record__(self, app, dbid, name, count, goid, goname):
         '''Insert a match record into the SQLite database.
@@ -392,15 +893,23 @@ class SQLiteCache(Cache):
         '''
         self.conn.commit()
     
+    def __close_writing__(self):
+        '''Mark the tables of the app being written as complete.
+        '''
+        self.cache_cursor.execute('insert into `populated` values (?)',
+                                  (self.writing, ))
+        self.conn.commit()
+    
     def __match_length__(self, app):
+        # Row ordinals are dense, so the highest one is the length
         self.cache_cursor.execute("""
-                SELECT count(1) FROM `%s_matches`;""" % (app))
+                SELECT coalesce(max(rowid), 0) FROM `%s_matches`;""" % (app))
         (length, ) = self.cache_cursor.fetchone()
         return length
     
     def __count_length__(self, app):
         self.cache_cursor.execute("""
-                SELECT count(1) FROM `%s_counts`;""" % (app))
+                SELECT coalesce(max(rowid), 0) FROM `%s_counts`;""" % (app))
         (length, ) = self.cache_cursor.fetchone()
         return length
 
@@ -409,28 +918,43 @@ class SQLiteCache(Cache):
            application app.
            Format: (dbname, count, goid, dbid, goname)
         '''
+        self.populate(app)
         if app in self.settings.apps:
             self.cache_cursor.execute("""
                     select name, count, goid, dbid, goname
                     from   `%s_matches`
-                    limit %s, 1
-                """ % (app, rownum))
+                    where  rowid = ?
+                """ % (app), (rownum + 1, ))
             return self.cache_cursor.fetchone()
         else:
             return None
     
+    def __get_rows__(self, app, start, stop):
+        '''Retrieve match rows start to stop (exclusive) with
+           one range query on the row ordinal.
+        '''
+        self.cache_cursor.execute("""
+                select name, count, goid, dbid, goname
+                from   `%s_matches`
+                where  rowid > ? and rowid <= ?
+                order by rowid
+            """ % (app), (start, stop))
+        return self.cache_cursor.fetchall()
+    
     def get_counts(self, app):
         '''Query the SQLite database for the counts
            data and return it in the format
            [(count1, count2, ...), (label1, label2, ...)]
         '''
+        self.populate(app)
         if app in self.settings.apps:
             maxresults = self.get_count_length(app)
             self.cache_cursor.execute("""
                     select count, name
                     from   `%s_counts`
-                    limit %s
-                """ % (app, maxresults))
+                    where  rowid <= ?
+                    order by rowid
+                """ % (app), (maxresults, ))
             results = self.cache_cursor.fetchall()
             if results:
                 return zip(*results)
@@ -439,6 +963,698 @@ class SQLiteCache(Cache):
         else:
             return [None, None]
         
+# Records of the MappedCache: heap offset of the name and count
+# of a count row, and heap offsets of the name, goid, dbid and
+# goname and count of a match row
+COUNT_RECORD = struct.Struct('<II')
+MATCH_RECORD = struct.Struct('<IIIII')
+HEAP_LENGTH = struct.Struct('<I')
+
+class MappedCache(Cache):
+    '''Subclass of Cache that stores the counts and matches of
+       each app as files of fixed-width records in a directory,
+       with their strings kept once each in a heap file of the app.
+       The files are memory-mapped when the cache is opened, so a
+       row is read by unpacking the record at rownum times the
+       record size, without a query.
+       
+       Values are stored as the text SQLiteCache stores them
+       (missing ones as 'None'), so both caches return the same
+       rows.  The files of an app are written under temporary
+       names and renamed, the heap last, when they are complete.
+    '''
+    
+    cache_name = 'results.map'
+    
+    def __init__(self, settings):
+        Cache.__init__(self, settings)
+    
+    def __open_cache__(self):
+        '''Memory-map the files of the apps that are complete.
+        '''
+        self.matches = {}
+        self.counts = {}
+        self.heaps = {}
+        self.decoded = {}
+        
+        # Caches written before the apps were populated on demand
+        # share one heap; they are written again
+        if os.path.exists(os.path.join(self.filename, 'heap')):
+            shutil.rmtree(self.filename, True)
+        if not os.path.exists(self.filename):
+            os.mkdir(self.filename)
+        for app in self.settings.apps:
+            if os.path.exists(self.__path__(app + '_heap')):
+                self.__map_app__(app)
+                self.populated.add(app)
+    
+    def __path__(self, name):
+        return os.path.join(self.filename, name)
+    
+    def __map_app__(self, app):
+        self.heaps[app] = self.__map__(app + '_heap')
+        self.counts[app] = self.__map__(app + '_counts')
+        self.matches[app] = self.__map__(app + '_matches')
+        self.decoded[app] = {}
+    
+    def __map__(self, name):
+        '''Returns: read-only memory map of a file of the cache,
+           or an empty string for an empty or missing file
+        '''
+        path = self.__path__(name)
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return ''
+        infile = open(path, 'rb')
+        try:
+            return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            infile.close()
+    
+    def __string__(self, value):
+        '''Add a value to the string heap, once for each text.
+           Returns: heap offset of the value (int)
+        '''
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        offset = self.strings.get(value)
+        if offset is None:
+            offset = self.strings[value] = self.heapsize
+            self.heapfile.write(HEAP_LENGTH.pack(len(value)))
+            self.heapfile.write(value)
+            self.heapsize += HEAP_LENGTH.size + len(value)
+        return offset
+    
+    def __get_string__(self, app, offset):
+        # Strings are decoded once; most goids, dbids and GO
+        # names recur in many rows
+        decoded = self.decoded[app]
+        value = decoded.get(offset)
+        if value is None:
+            heap = self.heaps[app]
+            (length, ) = HEAP_LENGTH.unpack_from(heap, offset)
+            start = offset + HEAP_LENGTH.size
+            value = decoded[offset] = \
+                    heap[start:start + length].decode('utf-8')
+        return value
+    
+    def __create_count_group__(self, app):
+        '''Start writing the heap of an app and create the record
+           file of its counts.
+        '''
+        self.heapfile = open(self.__path__(app + '_heap.tmp'), 'wb')
+        self.heapfile.write('\0')
+        self.heapsize = 1
+        self.strings = {}
+        self.writers = {}
+        self.keys = set()
+        self.writers['counts'] = open(self.__path__(app + '_counts.tmp'),
+                                      'wb')
+    
+    def __insert_count_record__(self, app, name, count):
+        '''Append a count record, unless the name has one.
+        '''
+        if name in self.keys:
+            return
+        self.keys.add(name)
+        self.writers['counts'].write(
+                COUNT_RECORD.pack(self.__string__(name), int(count)))
+    
+    def __create_match_group__(self, app):
+        '''Create the record file of the matches of an app.
+        '''
+        self.keys = set()
+        self.writers['matches'] = open(self.__path__(app + '_matches.tmp'),
+                                       'wb')
+    
+    def __insert_match_record__(self, app, dbid, name, count, goid, goname):
+        '''Append a match record, unless its dbid and goid have one.
+        '''
+        if (dbid, goid) in self.keys:
+            return
+        self.keys.add((dbid, goid))
+        self.writers['matches'].write(
+                MATCH_RECORD.pack(self.__string__(name), int(count),
+                                  self.__string__(goid),
+                                  self.__string__(dbid),
+                                  self.__string__(goname)))
+    
+    def __close_writing__(self):
+        '''Close the files of the app being written, move them in
+           place and map them for reading.
+        '''
+        app = self.writing
+        self.writers['counts'].close()
+        self.writers['matches'].close()
+        self.heapfile.close()
+        del self.strings, self.keys, self.writers, self.heapfile
+        for name in ('_counts', '_matches', '_heap'):
+            path = self.__path__(app + name)
+            if os.path.exists(path): # os.rename does not replace on Windows
+                os.remove(path)
+            os.rename(path + '.tmp', path)
+        self.__map_app__(app)
+    
+    def __match_length__(self, app):
+        return len(self.matches[app]) // MATCH_RECORD.size
+    
+    def __count_length__(self, app):
+        return len(self.counts[app]) // COUNT_RECORD.size
+    
+    def __get_match__(self, app, rownum):
+        name, count, goid, dbid, goname = MATCH_RECORD.unpack_from(
+                self.matches[app], rownum * MATCH_RECORD.size)
+        return (self.__get_string__(app, name), count,
+                self.__get_string__(app, goid),
+                self.__get_string__(app, dbid),
+                self.__get_string__(app, goname))
+    
+    def get_one_row(self, app, rownum):
+        '''Unpack a row from the match records of application app.
+           Format: (dbname, count, goid, dbid, goname)
+        '''
+        self.populate(app)
+        if app in self.settings.apps and \
+                0 <= rownum < self.__match_length__(app):
+            return self.__get_match__(app, rownum)
+        else:
+            return None
+    
+    def __get_rows__(self, app, start, stop):
+        '''Unpack match rows start to stop (exclusive).
+        '''
+        stop = min(stop, self.__match_length__(app))
+        if stop <= start:
+            return []
+        
+        # Unpack the records of the whole range at once
+        fields = struct.unpack_from('<%dI' % ((stop - start) * 5),
+                                    self.matches[app],
+                                    start * MATCH_RECORD.size)
+        decoded = self.decoded[app]
+        string = lambda offset: decoded.get(offset) or \
+                                self.__get_string__(app, offset)
+        return [(string(fields[n]), fields[n + 1], string(fields[n + 2]),
+                 string(fields[n + 3]), string(fields[n + 4]))
+                for n in xrange(0, len(fields), 5)]
+    
+    def get_counts(self, app):
+        '''Unpack the counts data of the chart and return it in
+           the format [(count1, count2, ...), (label1, label2, ...)]
+        '''
+        self.populate(app)
+        if app in self.settings.apps and self.__count_length__(app):
+            results = []
+            for rownum in xrange(self.get_count_length(app)):
+                name, count = COUNT_RECORD.unpack_from(
+                        self.counts[app], rownum * COUNT_RECORD.size)
+                results.append((count, self.__get_string__(app, name)))
+            return zip(*results)
+        else:
+            return [None, None]
+    
+# Bytes of memory a MemoryCache is estimated to take per row
+MEMORY_ROW_SIZE = 56
+
+class MemoryCache(Cache):
+    '''Subclass of Cache that keeps the counts and matches in
+       memory in a compact form: each column of an app is an array
+       of machine integers, and strings are stored once in a list
+       that the string columns hold indexes of.  Suits sessions whose
+       cache fits in the memory budget of the settings; it is built
+       again each time the session is opened.
+       
+       Values are stored as the text SQLiteCache stores them
+       (missing ones as 'None'), so both caches return the same
+       rows.
+    '''
+    
+    def __init__(self, settings):
+        Cache.__init__(self, settings)
+    
+    def __open_cache__(self):
+        '''Create the string list and the column arrays.
+        '''
+        self.strings = []
+        self.codes = {}
+        self.keys = {}
+        self.count = {}
+        self.table = {}
+    
+    def __string__(self, value):
+        '''Add a value to the string list, once for each text.
+           Returns: index of the value in the list (int)
+        '''
+        code = self.codes.get(value)
+        if code is not None:
+            return code
+        if isinstance(value, str):
+            value = value.decode('utf-8')
+        elif not isinstance(value, unicode):
+            value = unicode(value)
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+    
+    def __create_count_group__(self, app):
+        '''Create the name and count columns of an app's counts.
+        '''
+        self.count[app] = (array.array('i'), array.array('i'))
+        self.keys[app + '_counts'] = set()
+    
+    def __insert_count_record__(self, app, name, count):
+        '''Append a count row, unless the name has one.
+        '''
+        name = self.__string__(name)
+        keys = self.keys[app + '_counts']
+        if name in keys:
+            return
+        keys.add(name)
+        names, counts = self.count[app]
+        names.append(name)
+        counts.append(int(count))
+    
+    def __create_match_group__(self, app):
+        '''Create the name, count, goid, dbid and goname columns
+           of an app's matches.
+        '''
+        self.table[app] = tuple([array.array('i') for column in range(5)])
+        self.keys[app + '_matches'] = set()
+    
+    def __insert_match_record__(self, app, dbid, name, count, goid, goname):
+        '''Append a match row, unless its dbid and goid have one.
+        '''
+        string = self.__string__
+        dbid, goid = string(dbid), string(goid)
+        keys = self.keys[app + '_matches']
+        if (dbid, goid) in keys:
+            return
+        keys.add((dbid, goid))
+        names, counts, goids, dbids, gonames = self.table[app]
+        names.append(string(name))
+        counts.append(int(count))
+        goids.append(goid)
+        dbids.append(dbid)
+        gonames.append(string(goname))
+    
+    def __close_writing__(self):
+        '''Drop the structures only needed while writing the
+           groups of the app being written, and report the memory
+           taken up.
+        '''
+        app = self.writing
+        del self.keys[app + '_counts'], self.keys[app + '_matches']
+        if len(self.table) == len(self.settings.apps):
+            self.codes = {}
+        print "Results cache: %d rows in %.1f MB of memory" % (
+                    self.get_row_count(), self.get_size() / 1048576.0)
+    
+    def __match_length__(self, app):
+        return len(self.table[app][0])
+    
+    def __count_length__(self, app):
+        return len(self.count[app][0])
+    
+    def get_one_row(self, app, rownum):
+        '''Look up a row of the match columns of application app.
+           Format: (dbname, count, goid, dbid, goname)
+        '''
+        self.populate(app)
+        if app in self.settings.apps and \
+                0 <= rownum < self.__match_length__(app):
+            names, counts, goids, dbids, gonames = self.table[app]
+            strings = self.strings
+            return (strings[names[rownum]], counts[rownum],
+                    strings[goids[rownum]], strings[dbids[rownum]],
+                    strings[gonames[rownum]])
+        else:
+            return None
+    
+    def __get_rows__(self, app, start, stop):
+        '''Look up match rows start to stop (exclusive).
+        '''
+        names, counts, goids, dbids, gonames = self.table[app]
+        strings = self.strings
+        return [(strings[name], count, strings[goid], strings[dbid],
+                 strings[goname])
+                for name, count, goid, dbid, goname in
+                    zip(names[start:stop], counts[start:stop],
+                        goids[start:stop], dbids[start:stop],
+                        gonames[start:stop])]
+    
+    def get_counts(self, app):
+        '''Return the counts data of the chart in the format
+           [(count1, count2, ...), (label1, label2, ...)]
+        '''
+        self.populate(app)
+        if app in self.settings.apps and self.__count_length__(app):
+            names, counts = self.count[app]
+            length = self.get_count_length(app)
+            return [tuple(counts[:length]),
+                    tuple([self.strings[name] for name in names[:length]])]
+        else:
+            return [None, None]
+    
+    def get_row_count(self):
+        '''Returns: number of count and match rows stored (int)
+        '''
+        return sum([len(names) for names, counts in self.count.values()]) + \
+               sum([len(columns[0]) for columns in self.table.values()])
+    
+    def get_size(self):
+        '''Returns: bytes of memory taken up by the columns and
+           strings, not counting the per-app containers (int)
+        '''
+        size = sys.getsizeof(self.strings)
+        size += sum([sys.getsizeof(value) for value in self.strings])
+        for columns in self.count.values() + self.table.values():
+            size += sum([column.itemsize * len(column) for column in columns])
+        return size
+    
+class GONameCache:
+    '''Gene ontology term names resolved by earlier sessions,
+       kept in a SQLite file in the data directory so repeated
+       analyses need few GO database queries.  Terms the GO
+       database does not know are remembered as well (name NULL).
+       
+       Names older than max_days are looked up again (0 keeps
+       them forever), and once the cache holds more than
+       max_size terms the least recently used ones are evicted.
+    '''
+    
+    def __init__(self, filename, max_size, max_days):
+        '''Open or create the GO name cache at filename.
+        '''
+        self.filename = filename
+        self.max_size = max_size
+        self.max_days = max_days
+        self.hits = 0
+        self.misses = 0
+        
+        self.conn = sqlite3.connect(filename, timeout=30)
+        self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS `go_name`
+                    ( `acc` varchar(16) PRIMARY KEY,
+                      `name` varchar(255) DEFAULT NULL,
+                      `created` int(10) NOT NULL,
+                      `last_used` int(10) NOT NULL );""")
+        self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS `go_name_last_used`
+                    ON `go_name` (`last_used`);""")
+        self.conn.commit()
+    
+    def __oldest__(self):
+        '''Returns: creation time of the oldest names still
+           used (int)
+        '''
+        if self.max_days > 0:
+            return int(time.time()) - self.max_days * 86400
+        return 0
+    
+    def lookup(self, go_ids):
+        '''Retrieve the cached names of the given term ids and
+           mark them as used.
+           Returns: {term id: name or None} of the cached ids (dict)
+        '''
+        names = {}
+        oldest = self.__oldest__()
+        for start in xrange(0, len(go_ids), 998):
+            batch = go_ids[start:start + 998]
+            for acc, name in self.conn.execute("""
+                    select acc, name
+                    from   `go_name`
+                    where  created >= ? and acc in (%s)""" %
+                    ', '.join(['?'] * len(batch)), [oldest] + batch):
+                names[acc] = name
+        
+        now = int(time.time())
+        self.conn.executemany(
+            'update `go_name` set last_used = ? where acc = ?',
+            [(now, acc) for acc in names])
+        self.conn.commit()
+        self.hits += len(names)
+        self.misses += len(go_ids) - len(names)
+        return names
+    
+    def store(self, names):
+        '''Add the given {term id: name or None} to the cache
+           and evict old or surplus names.
+        '''
+        now = int(time.time())
+        self.conn.executemany(
+            'insert or replace into `go_name` values (?, ?, ?, ?)',
+            [(acc, name, now, now) for acc, name in names.iteritems()])
+        self.evict()
+        self.conn.commit()
+    
+    def evict(self):
+        '''Remove names older than max_days, then the least
+           recently used names beyond max_size.
+        '''
+        self.conn.execute('delete from `go_name` where created < ?',
+                          (self.__oldest__(), ))
+        surplus = self.get_size() - self.max_size
+        if self.max_size >= 0 and surplus > 0:
+            self.conn.execute("""
+                delete from `go_name`
+                where  acc in ( select   acc
+                                from     `go_name`
+                                order by last_used, acc
+                                limit    ? )""", (surplus, ))
+    
+    def get_size(self):
+        '''Returns: number of cached names (int)
+        '''
+        return self.conn.execute(
+            'select count(1) from `go_name`').fetchone()[0]
+    
+    def get_stats(self):
+        '''Returns: (hits, misses, cached names) (tuple of int)
+        '''
+        return self.hits, self.misses, self.get_size()
+    
+    def close(self):
+        '''Print the hit/miss statistics and close the cache.
+        '''
+        print "GO name cache: %d hits, %d misses, %d names cached" % \
+              self.get_stats()
+        self.conn.close()
+
+class SessionStore:
+    '''Imported sessions kept in the sessions directory for reuse,
+       addressed by the contents of their input files: the id of a
+       session is derived from the SHA-1 digests of its input files
+       and the session schema version, so opening identical files
+       again finds their tables already imported.  The results cache
+       also depends on the apps and GO lookup settings and is rebuilt
+       if a session is reused with different ones.
+       
+       The index of kept sessions is a SQLite file in the data
+       directory.  Once the kept sessions take up more than max_size
+       MB of disk (-1 for no limit) the least recently used ones are
+       deleted.  File digests are remembered by path, size and
+       modification time, so unchanged files are only read once.
+       The digests may be computed in another thread than the one
+       that opened the index, while get_progress() reports how far
+       it has read.
+    '''
+    
+    def __init__(self, settings):
+        '''Open or create the session index given by the settings.
+        '''
+        self.settings = settings
+        self.sessionsdir = settings.getsessionsdir()
+        self.max_size = settings.getsessionstoresize()
+        
+        self.conn = sqlite3.connect(settings.getsessionindex(), timeout=30,
+                                    check_same_thread=False)
+        
+        # Bytes of the input files to read for their digests, and
+        # read so far
+        self.hashing = 0
+        self.hashed = 0
+        
+        self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS `session`
+                    ( `session` varchar(40) PRIMARY KEY,
+                      `results` varchar(40) NOT NULL,
+                      `size` bigint NOT NULL,
+                      `created` int(10) NOT NULL,
+                      `last_used` int(10) NOT NULL );""")
+        self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS `digest`
+                    ( `path` varchar(255) PRIMARY KEY,
+                      `size` bigint NOT NULL,
+                      `mtime` real NOT NULL,
+                      `sha1` varchar(40) NOT NULL );""")
+        self.conn.commit()
+    
+    def get_session_id(self, filenames):
+        '''Returns: id of the session of the given input files (str)
+        '''
+        self.hashing = sum([os.path.getsize(filename)
+                            for filename in filenames])
+        self.hashed = 0
+        digests = [self.__digest__(filename) for filename in filenames]
+        digests.append('schema %d' % (importers.SCHEMA_VERSION))
+        return hashlib.sha1('\n'.join(digests)).hexdigest()[:16]
+    
+    def __digest__(self, filename):
+        '''Returns: hex SHA-1 digest of a file's contents (str)
+        '''
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        row = self.conn.execute("""
+                select sha1
+                from   `digest`
+                where  path = ? and size = ? and mtime = ?""",
+                (path, stat.st_size, stat.st_mtime)).fetchone()
+        if row:
+            self.hashed += stat.st_size
+            return str(row[0])
+        
+        sha1 = hashlib.sha1()
+        infile = open(path, 'rb')
+        while True:
+            data = infile.read(1 << 20)
+            if not data:
+                break
+            sha1.update(data)
+            self.hashed += len(data)
+        infile.close()
+        self.conn.execute('insert or replace into `digest` values (?, ?, ?, ?)',
+                          (path, stat.st_size, stat.st_mtime,
+                           sha1.hexdigest()))
+        self.conn.commit()
+        return sha1.hexdigest()
+    
+    def get_progress(self):
+        '''Returns: fraction of the input files get_session_id has
+           read so far (float)
+        '''
+        return min(1.0, float(self.hashed) / max(1, self.hashing))
+    
+    def __results_key__(self):
+        '''Returns: digest of the settings the results cache of a
+           session depends on (str)
+        '''
+        return hashlib.sha1(repr((self.settings.getapps(),
+                                  self.settings.usegolookup()))).hexdigest()
+    
+    def contains(self, session):
+        '''Returns: whether the session is kept (bool)
+        '''
+        return self.conn.execute(
+            'select count(1) from `session` where session = ?',
+            (session, )).fetchone()[0] > 0
+    
+    def open(self, session):
+        '''Prepare a kept session for reuse with the current
+           settings, deleting its results cache if they have changed,
+           and mark it as used.
+           Returns: whether the session is kept (bool)
+        '''
+        row = self.conn.execute(
+            'select results from `session` where session = ?',
+            (session, )).fetchone()
+        sessiondir = os.path.join(self.sessionsdir, session)
+        if row is None:
+            return False
+        if not os.path.isdir(sessiondir):
+            self.conn.execute('delete from `session` where session = ?',
+                              (session, ))
+            self.conn.commit()
+            return False
+        
+        if row[0] != self.__results_key__():
+            for cache in (SQLiteCache, MappedCache):
+                results = os.path.join(sessiondir, cache.cache_name)
+                if os.path.isdir(results):
+                    shutil.rmtree(results, True)
+                elif os.path.exists(results):
+                    os.remove(results)
+        self.conn.execute('update `session` set last_used = ? '
+                          'where session = ?', (int(time.time()), session))
+        self.conn.commit()
+        return True
+    
+    def store(self, session):
+        '''Keep the session, whose import is complete, and evict the
+           least recently used sessions that no longer fit.  Its
+           results cache is built later, so update_size() should be
+           called once it has been.
+        '''
+        size = self.__get_session_size__(session)
+        now = int(time.time())
+        row = self.conn.execute(
+            'select created from `session` where session = ?',
+            (session, )).fetchone()
+        created = row and row[0] or now
+        self.conn.execute(
+            'insert or replace into `session` values (?, ?, ?, ?, ?)',
+            (session, self.__results_key__(), size, created, now))
+        self.evict(keep=session)
+        self.conn.commit()
+    
+    def update_size(self, session):
+        '''Record the disk taken up by a kept session again, e.g.
+           once its results cache has been built, and evict the least
+           recently used sessions that no longer fit.
+        '''
+        self.conn.execute('update `session` set size = ? where session = ?',
+                          (self.__get_session_size__(session), session))
+        self.evict(keep=session)
+        self.conn.commit()
+    
+    def __get_session_size__(self, session):
+        '''Returns: bytes of disk taken up by a session directory (int)
+        '''
+        size = 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.sessionsdir,
+                                                          session)):
+            for filename in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass # removed while walking
+        return size
+    
+    def evict(self, keep=None):
+        '''Delete the least recently used sessions other than keep
+           while the kept sessions take up more than max_size MB.
+        '''
+        if self.max_size < 0:
+            return
+        surplus = self.get_size() - (self.max_size << 20)
+        for session, size in self.conn.execute("""
+                select   session, size
+                from     `session`
+                order by last_used, created""").fetchall():
+            if surplus <= 0:
+                break
+            if session == keep:
+                continue
+            shutil.rmtree(os.path.join(self.sessionsdir, session), True)
+            self.conn.execute('delete from `session` where session = ?',
+                              (session, ))
+            surplus -= size
+            print "Session store: evicted session %s (%d bytes)" % (
+                        session, size)
+    
+    def get_size(self):
+        '''Returns: bytes of disk taken up by the kept sessions (int)
+        '''
+        return self.conn.execute(
+            'select coalesce(sum(size), 0) from `session`').fetchone()[0]
+    
+    def close(self):
+        '''Close the session index.
+        '''
+        self.conn.close()
+
 class IPRStatsData:
     '''This class is the original object used to retrieve
        aggregate results from the database.  It is now
@@ -449,7 +1665,7 @@ class IPRStatsData:
     def __init__(self, settings):
         
         self.settings = settings
-        self.cache = SQLiteCache(self.settings)
+        self.cache = self.__get_cache__()
         
         self.chart = {}
         for app in self.settings.getapps():
@@ -458,7 +1674,191 @@ class IPRStatsData:
         sqlpath = os.path.join(self.settings.getsessiondir(), 'iprsql.sql')
         if os.path.exists(sqlpath):
             os.remove(sqlpath)
+    
+    def close(self):
+        '''Close the database connections the cache opened in the
+           calling thread, before the session is closed.
+        '''
+        self.cache.close_connections()
+    
+    def __get_cache__(self):
+        '''Keep the results in a MemoryCache when their estimated
+           size fits in the memory budget of the settings, otherwise
+           in the disk cache of the settings' backend.  A disk cache
+           that has been built already is always opened.
+           Returns: Cache
+        '''
+        if self.settings.getcachebackend() == 'mapped':
+            disk = MappedCache
+        else:
+            disk = SQLiteCache
+        budget = self.settings.getcachememorybudget()
+        results = os.path.join(self.settings.getsessiondir(), disk.cache_name)
+        if budget <= 0 or os.path.exists(results):
+            print "Results cache: %s" % (disk.__name__)
+            return disk(self.settings)
+        
+        rows = self.__estimate_rows__()
+        if rows is None or rows * MEMORY_ROW_SIZE > budget << 20:
+            print "Results cache: %s, about %s rows over the %d MB " \
+                  "memory budget" % (disk.__name__, rows, budget)
+            return disk(self.settings)
+        
+        print "Results cache: MemoryCache, about %d rows within the " \
+              "%d MB memory budget" % (rows, budget)
+        return MemoryCache(self.settings)
+    
+    def __estimate_rows__(self):
+        '''Estimate the rows of the results cache from the session
+           tables: each match signature has a count row, and a match
+           row for each GO term of the protein it is listed with.
+           Returns: number of rows (int), or None if the session
+                    cannot be read
+        '''
+        session = self.settings.getsession()
+        dbs = self.settings.getlocaldb()
+        try:
+            if self.settings.usesqlite():
+                conn = sqlite3.connect(os.path.join(
+                            self.settings.getsessiondir(), dbs.getdb()))
+            else:
+                conn = MySQLdb.connect(host=dbs.gethost(),
+                                       user=dbs.getuser(),
+                                       passwd=dbs.getpasswd(),
+                                       port=dbs.getport(),
+                                       db=dbs.getdb())
+            cursor = conn.cursor()
+            counts = []
+            for query in ['select count(1) from ( select 1 from '
+                          '`%s_iprmatch` group by db_name, name ) as A',
+                          'select count(1) from `%s_protein`',
+                          'select count(1) from `%s_protein_classification`']:
+                cursor.execute(query % (session))
+                counts.append(cursor.fetchone()[0])
+            conn.close()
+        except:
+            return None
         
+        signatures, proteins, terms = counts
+        return signatures * 2 + signatures * terms // max(proteins, 1)
+
+class ResultsLoader:
+    '''Pool of worker threads that load the results of apps: each
+       populates the cache of an IPRStatsData object for an app and
+       saves its chart, then calls callback(loader, app, saved) from
+       the worker thread, where saved tells whether the chart was
+       saved.  Each worker reads the session over its own database
+       connections.  An app queued first is populated on its own;
+       the other queued apps are populated together, in one pass of
+       the cache queries.  The cache populates one app or pass at a
+       time, so the workers overlap it with saving (downloading or
+       drawing) the charts of other apps.
+    '''
+    
+    def __init__(self, iprstat, callback, workers=None):
+        self.iprstat = iprstat
+        self.callback = callback
+        if workers is None:
+            workers = iprstat.settings.getcacheworkers()
+        self.workers = max(1, workers)
+        self.lock = Lock()
+        self.queue = []
+        self.background = set()
+        self.loading = set()
+        self.done = set()
+        self.threads = []
+        self.running = 0
+    
+    def load(self, app, first=False):
+        '''Queue an app to be loaded, ahead of the queued apps if
+           first is set, unless it is queued or loaded already.
+        '''
+        self.lock.acquire()
+        try:
+            if app in self.queue and first:
+                self.queue.remove(app)
+            elif app in self.queue or app in self.loading or \
+                    app in self.done:
+                return
+            if first:
+                self.queue.insert(0, app)
+                self.background.discard(app)
+            else:
+                self.queue.append(app)
+                self.background.add(app)
+            if self.running < self.workers:
+                self.running += 1
+                thread = Thread(target=self.__work__)
+                thread.setDaemon(True)
+                thread.start()
+                self.threads.append(thread)
+        finally:
+            self.lock.release()
+    
+    def __work__(self):
+        while True:
+            self.lock.acquire()
+            if not self.queue:
+                self.running -= 1
+                self.lock.release()
+                break
+            app = self.queue.pop(0)
+            self.loading.add(app)
+            apps = [app]
+            if app in self.background:
+                apps += [queued for queued in self.queue
+                                if queued in self.background]
+            self.background.difference_update(apps)
+            self.lock.release()
+            
+            saved = False
+            try:
+                self.iprstat.cache.populate_apps(apps)
+                saved = self.iprstat.chart[app].Save()
+            except:
+                print "Cannot load the results of %s: %s" % (
+                            app, sys.exc_info()[1])
+            
+            self.lock.acquire()
+            self.loading.discard(app)
+            self.done.add(app)
+            self.lock.release()
+            self.callback(self, app, saved)
+        self.iprstat.cache.close_connections()
+    
+    def cancel(self):
+        '''Drop the apps that are queued; the workers stop once
+           the apps they are loading are done.  Apps can still be
+           queued afterwards.
+        '''
+        self.lock.acquire()
+        self.queue = []
+        self.background = set()
+        self.lock.release()
+    
+    def join(self):
+        '''Wait for the workers to stop.
+        '''
+        for thread in self.threads:
+            thread.join()
+    
+    def get_progress(self):
+        '''Returns: (apps loaded, apps loaded, loading or queued)
+                    (tuple of int)
+        '''
+        self.lock.acquire()
+        try:
+            return (len(self.done),
+                    len(self.done) + len(self.loading) + len(self.queue))
+        finally:
+            self.lock.release()
+    
+    def is_loading(self):
+        '''Returns: whether apps are queued or loading (bool)
+        '''
+        done, total = self.get_progress()
+        return done < total
+
 
 # Settings classes
 #-----------------------------------------------------------------------------
@@ -679,6 +2079,10 @@ class Settings:
         
         self.maxtableresults = self.config.getint('general',
                                                   'max_table_results')
+        self.gridblocksize = self.__get_option__('general',
+                                                 'grid_block_size', 200)
+        self.gridcacheblocks = self.__get_option__('general',
+                                                   'grid_cache_blocks', 32)
         self.chart = ChartSettings(
                         self.config.getint('general', 'max_chart_results'),
                         self.config.get('general', 'chart_type'),
@@ -686,9 +2090,58 @@ class Settings:
         
         self.sqlite = self.config.getboolean('local db', 'use_sqlite')
         self.localdb = self.__load_db_settings__('local db')
+        self.bulkload = self.__get_option__('local db', 'bulk_load', True)
         
         self.golookup = self.config.getboolean('go db', 'go_lookup')
         self.godb = self.__load_db_settings__('go db')
+        
+        self.gobatchsize = self.__get_option__('go db', 'batch_size', 500)
+        self.goconnections = self.__get_option__('go db', 'connections', 4)
+        self.gobackend = self.__get_option__('go db', 'backend', 'mysql')
+        self.goindex = os.path.join(self.datadir,
+                self.__get_option__('go db', 'index', 'go_terms.db'))
+        self.goobofile = self.__get_option__('go db', 'obo_file', '')
+        self.gonamecache = self.__get_option__('go db', 'name_cache',
+                                               'go_names.db')
+        if self.gonamecache:
+            self.gonamecache = os.path.join(self.datadir, self.gonamecache)
+        self.gonamecachesize = self.__get_option__('go db',
+                                                   'name_cache_size', 100000)
+        self.gonamecachedays = self.__get_option__('go db',
+                                                   'name_cache_days', 90)
+        
+        self.sessionstore = self.__get_option__('sessions', 'reuse', True)
+        self.sessionindex = os.path.join(self.datadir,
+                self.__get_option__('sessions', 'index', 'sessions.db'))
+        self.sessionstoresize = self.__get_option__('sessions', 'max_size',
+                                                    2048)
+        
+        self.cachebackend = self.__get_option__('cache', 'backend', 'sqlite')
+        self.cachememorybudget = self.__get_option__('cache', 'memory_budget',
+                                                     64)
+        self.cachewarmup = self.__get_option__('cache', 'warm_up', True)
+        self.cacheworkers = self.__get_option__('cache', 'workers', 4)
+        
+        self.batchsize = self.__get_option__('import', 'batch_size', 5000)
+        self.processes = self.__get_option__('import', 'processes', 1)
+        self.shardsize = self.__get_option__('import', 'shard_size', 16)
+        self.xmlparser = self.__get_option__('import', 'parser', 'sax')
+    
+    def __get_option__(self, section, option, default):
+        '''Read a setting that older configuration files may not
+           have yet, falling back to default when it is missing.
+           The value is converted to the type of default.
+           Returns: setting value
+        '''
+        if not self.config.has_option(section, option):
+            return default
+        elif type(default) is bool:
+            return self.config.getboolean(section, option)
+        elif type(default) is int:
+            return self.config.getint(section, option)
+        elif type(default) is float:
+            return self.config.getfloat(section, option)
+        return self.config.get(section, option)
     
     def __load_db_settings__(self, section):
         '''Load connections from a given section in the configuration.
@@ -706,23 +2159,42 @@ class Settings:
     def newsession(self, session_id=None):
         '''Create a new session with the provided session_id;
            creates a random session id if session_id is not provided
-           and deletes the old session files if possible.
+           and deletes the old session files if possible (see
+           closesession).
            Returns: the new session id (str)
         '''
         
+        if not session_id or self.getsessiondir() != \
+                os.path.join(self.getsessionsdir(), session_id):
+            self.closesession()
         if session_id:
             self.session = session_id
         else:
-            try: # Bad hack... fix this...
-                shutil.rmtree(self.getsessiondir())
-            except:
-                pass
             chars = string.letters + string.digits
             self.session = ''.join([choice(chars) for _ in xrange(8)])
         
         self.setsessiondir(self.session)
         
         return self.session
+    
+    def closesession(self):
+        '''Delete the current session files, unless the session
+           holds an unfinished import, which can be resumed, or is
+           kept in the session store.
+        '''
+        sessiondir = self.getsessiondir()
+        if not sessiondir or importers.is_resumable(sessiondir):
+            return
+        if self.usesessionstore():
+            store = SessionStore(self)
+            kept = store.contains(os.path.basename(sessiondir))
+            store.close()
+            if kept:
+                return
+        try: # Bad hack... fix this...
+            shutil.rmtree(sessiondir)
+        except:
+            pass
 
     def gethomedir(self):
         '''Returns: home directory (str)
@@ -796,6 +2268,20 @@ class Settings:
         '''
         return self.maxtableresults
     
+    def getgridblocksize(self):
+        '''Get the number of table rows the grid reads from
+           the cache at a time.
+           Returns: grid block size (int)
+        '''
+        return self.gridblocksize
+    
+    def getgridcacheblocks(self):
+        '''Get the number of row blocks each grid keeps in
+           memory.
+           Returns: grid cache capacity in blocks (int)
+        '''
+        return self.gridcacheblocks
+    
     def getchartsettings(self):
         '''Returns: current chart settings (ChartSettings)
         '''
@@ -816,6 +2302,12 @@ class Settings:
         '''
         return self.golookup
     
+    def usebulkload(self):
+        '''Returns: whether MySQL sessions are bulk loaded from
+           spool files with LOAD DATA LOCAL INFILE (bool)
+        '''
+        return self.bulkload
+    
     def getlocaldb(self):
         '''Returns: local MySQL db connection details (DBSettings)
         '''
@@ -826,6 +2318,127 @@ class Settings:
         '''
         return self.godb
     
+    def getbatchsize(self):
+        '''Returns: number of parsed rows buffered before they are
+           written to the local database (int)
+        '''
+        return self.batchsize
+    
+    def getprocesses(self):
+        '''Returns: number of worker processes used to parse XML
+           files; 0 uses every CPU and 1 parses in a single
+           thread (int)
+        '''
+        return self.processes
+    
+    def getshardsize(self):
+        '''Returns: size in MB of the XML shards handed to each
+           worker process (int)
+        '''
+        return self.shardsize
+    
+    def getxmlparser(self):
+        '''Returns: XML parser backend, either 'sax' or
+           'iterparse' (str)
+        '''
+        return self.xmlparser
+    
+    def getgobatchsize(self):
+        '''Returns: number of GO term ids resolved per
+           query (int)
+        '''
+        return self.gobatchsize
+    
+    def getgoconnections(self):
+        '''Returns: maximum number of concurrent GO database
+           connections used to resolve term names (int)
+        '''
+        return self.goconnections
+    
+    def getgobackend(self):
+        '''Returns: where GO term names are looked up, either 'mysql'
+           for the GO MySQL database or 'local' for the GO term
+           index (str)
+        '''
+        return self.gobackend
+    
+    def getgoindex(self):
+        '''Returns: path of the local GO term index (str)
+           Default: '.iprstats/go_terms.db' or
+                    '$HOME/.iprstats/go_terms.db'
+        '''
+        return self.goindex
+    
+    def getgoobofile(self):
+        '''Returns: path of the GO OBO or flat term file the local
+           GO term index is built from, or '' (str)
+        '''
+        return self.goobofile
+    
+    def getgonamecache(self):
+        '''Returns: path of the persistent GO name cache, or ''
+           if it is disabled (str)
+           Default: '.iprstats/go_names.db' or
+                    '$HOME/.iprstats/go_names.db'
+        '''
+        return self.gonamecache
+    
+    def getgonamecachesize(self):
+        '''Returns: maximum number of GO names kept in the GO
+           name cache; -1 is unbounded (int)
+        '''
+        return self.gonamecachesize
+    
+    def getgonamecachedays(self):
+        '''Returns: days a cached GO name is used before it is
+           looked up again; 0 never expires them (int)
+        '''
+        return self.gonamecachedays
+    
+    def usesessionstore(self):
+        '''Returns: whether imported SQLite sessions are kept for
+           reuse when the same input files are opened again (bool)
+        '''
+        return self.sessionstore and self.sqlite
+    
+    def getsessionindex(self):
+        '''Returns: path of the index of kept sessions (str)
+           Default: '.iprstats/sessions.db'
+        '''
+        return self.sessionindex
+    
+    def getsessionstoresize(self):
+        '''Returns: MB of disk the kept sessions may take up;
+           -1 for no limit (int)
+        '''
+        return self.sessionstoresize
+    
+    def getcachebackend(self):
+        '''Returns: format of the results cache, 'sqlite' for a
+           SQLite database or 'mapped' for memory-mapped record
+           files (str)
+        '''
+        return self.cachebackend
+    
+    def getcachememorybudget(self):
+        '''Returns: MB of memory the results cache may take up to be
+           kept in memory instead of on disk; 0 always keeps it on
+           disk (int)
+        '''
+        return self.cachememorybudget
+    
+    def usecachewarmup(self):
+        '''Returns: whether the apps of the results cache that have
+           not been looked at are populated in the background (bool)
+        '''
+        return self.cachewarmup
+    
+    def getcacheworkers(self):
+        '''Returns: number of worker threads loading the results
+           and charts of the apps in the GUI (int)
+        '''
+        return self.cacheworkers
+    
     def setgolookup(self, value):
         '''Sets the GO lookup variable to the specified value
         '''
@@ -861,6 +2474,10 @@ except ImportError:
     
 from pygooglechart import PieChart2D, GroupedHorizontalBarChart
 
+# pylab keeps its figures in global state, so charts saved from
+# several threads are drawn one at a time
+PYLAB_LOCK = Lock()
+
 class Chart:
     """Object used to define the data, labels, title, filename,
        etc for generating, saving, and displaying charts.
@@ -971,11 +2588,15 @@ class Chart:
         
         #try:
         if settings.getgenerator() == 'pylab':
-            if settings.gettype() == 'pie':
-                self.CreatePylabPie(counts, labels, settings)
-            else:
-                self.CreatePylabBar(counts, labels, settings)
-            pylab.savefig(filename)
+            PYLAB_LOCK.acquire()
+            try:
+                if settings.gettype() == 'pie':
+                    self.CreatePylabPie(counts, labels, settings)
+                else:
+                    self.CreatePylabBar(counts, labels, settings)
+                pylab.savefig(filename)
+            finally:
+                PYLAB_LOCK.release()
         else:
             if settings.gettype() == 'pie':
                 chart = self.CreateGooglePie(counts, labels, settings)
@@ -999,6 +2620,16 @@ class Chart:
             return wx.Bitmap(self.filename, wx.BITMAP_TYPE_ANY)
         else:
             return None
+    
+    def GetBitmap(self):
+        """Return the chart saved by Save as a wxPython Bitmap,
+           without generating it again. Bitmaps can only be made
+           in the GUI thread.
+        """
+        if wx_avail and os.path.exists(self.filename):
+            return wx.Bitmap(self.filename, wx.BITMAP_TYPE_ANY)
+        else:
+            return None
 
 '''
 if __name__ == '__main__':
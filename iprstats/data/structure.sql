@@ -1,7 +1,10 @@
-CREATE TABLE `%(SESSION)s_interpro` ( `interpro_id` varchar(25) NOT NULL, `name` varchar(80) DEFAULT NULL, `ipr_type` char(20) DEFAULT NULL, PRIMARY KEY (`interpro_id`) );
-CREATE TABLE `%(SESSION)s_iprmatch` ( `id` varchar(25) DEFAULT NULL, `pim_id` int(10) DEFAULT NULL, `name` varchar(80) DEFAULT NULL, `db_name` varchar(25) DEFAULT NULL, PRIMARY KEY (`pim_id`) );
-CREATE TABLE `%(SESSION)s_location` ( `loc_id` integer NOT NULL %(AUTO)s, `match_id` varchar(25) DEFAULT NULL, `pim_id` int(10) DEFAULT NULL, `start_p` int(10) DEFAULT NULL, `end_p` int(10) DEFAULT NULL, `score` float DEFAULT NULL, `status` char(1) DEFAULT NULL, `evidence` varchar(25) DEFAULT NULL, PRIMARY KEY (`loc_id`) );
-CREATE TABLE `%(SESSION)s_protein` ( `protein_id` varchar(50) NOT NULL, `length` int(11) DEFAULT NULL, `crc64` varchar(25) DEFAULT NULL, `nprot` int(11) DEFAULT NULL, PRIMARY KEY (`protein_id`) );
-CREATE TABLE `%(SESSION)s_protein_classification` ( `id` integer NOT NULL %(AUTO)s, `protein_id` varchar(50) NOT NULL, `class_id` varchar(50) NOT NULL, `class_type` varchar(20) NOT NULL, PRIMARY KEY (`id`) );
-CREATE TABLE `%(SESSION)s_protein_interpro` ( `protein_id` varchar(50) NOT NULL, `interpro_id` varchar(25) NOT NULL, PRIMARY KEY (`protein_id`, `interpro_id`) );
-CREATE TABLE `%(SESSION)s_protein_interpro_match` ( `pim_id` int(10) NOT NULL, `protein_id` varchar(50) NOT NULL, `interpro_id` varchar(25) NOT NULL, `match_id` varchar(25) NOT NULL, PRIMARY KEY (`pim_id`) );
+-- IPRStats session schema version 4
+CREATE TABLE `%(SESSION)s_dictionary` ( `code` int(10) NOT NULL, `value` varchar(80) NOT NULL, PRIMARY KEY (`code`) );
+CREATE TABLE `%(SESSION)s_interpro` ( `interpro_key` integer NOT NULL, `interpro_id` varchar(25) NOT NULL, `name` varchar(80) DEFAULT NULL, `ipr_type` int(10) DEFAULT NULL, PRIMARY KEY (`interpro_key`), UNIQUE (`interpro_id`) );
+CREATE TABLE `%(SESSION)s_iprmatch` ( `match_key` int(10) DEFAULT NULL, `pim_id` int(10) DEFAULT NULL, `name` varchar(80) DEFAULT NULL, `db_name` int(10) DEFAULT NULL, PRIMARY KEY (`pim_id`) );
+CREATE TABLE `%(SESSION)s_location` ( `loc_id` integer NOT NULL %(AUTO)s, `match_key` int(10) DEFAULT NULL, `pim_id` int(10) DEFAULT NULL, `start_p` int(10) DEFAULT NULL, `end_p` int(10) DEFAULT NULL, `score` float DEFAULT NULL, `status` int(10) DEFAULT NULL, `evidence` int(10) DEFAULT NULL, PRIMARY KEY (`loc_id`) );
+CREATE TABLE `%(SESSION)s_match` ( `match_key` integer NOT NULL, `match_id` varchar(25) NOT NULL, PRIMARY KEY (`match_key`), UNIQUE (`match_id`) );
+CREATE TABLE `%(SESSION)s_protein` ( `protein_key` integer NOT NULL, `protein_id` varchar(50) NOT NULL, `length` int(11) DEFAULT NULL, `crc64` varchar(25) DEFAULT NULL, `nprot` int(11) DEFAULT NULL, PRIMARY KEY (`protein_key`), UNIQUE (`protein_id`) );
+CREATE TABLE `%(SESSION)s_protein_classification` ( `id` integer NOT NULL %(AUTO)s, `protein_key` int(10) NOT NULL, `class_id` varchar(50) NOT NULL, `class_type` int(10) NOT NULL, PRIMARY KEY (`id`) );
+CREATE TABLE `%(SESSION)s_protein_interpro` ( `protein_key` int(10) NOT NULL, `interpro_key` int(10) NOT NULL, PRIMARY KEY (`protein_key`, `interpro_key`) );
+CREATE TABLE `%(SESSION)s_protein_interpro_match` ( `pim_id` int(10) NOT NULL, `protein_key` int(10) NOT NULL, `interpro_key` int(10) NOT NULL, `match_key` int(10) NOT NULL, PRIMARY KEY (`pim_id`) );
@@ -95,29 +95,20 @@ class html:
         print >> file, '  </tr>'
         
         # Create a table row for each row in the cache
-        length = self.iprstat.cache.get_match_length(app)
-        for r in range(length):
-            row = self.iprstat.cache.get_one_row(app, r)
-            if row:
-                print >> file, '<tr>'
-                print >> file, '<td>'
-                print >> file, self.__get_link__(row[0],
-                                    self.iprstat.cache.get_url(app, r),
-                                    '_blank')
-                print >> file, '</td>'
-                print >> file, '<td>' + str(row[1]) + '</td>'
-                print >> file, '<td>'
-                
-                if self.iprstat.settings.usegolookup(): cell3 = row[4]
-                else: cell3 = row[2]
-                print >> file, self.__get_link__(cell3,
-                                    self.iprstat.cache.get_url(app, r, True),
-                                    '_blank')
-                
-                print >> file, '</td>'
-                print >> file, '</tr>'
-            else:
-                break
+        for row in self.iprstat.cache.iter_rows(app):
+            print >> file, '<tr>'
+            print >> file, '<td>'
+            print >> file, self.__get_link__(row[0], row[5], '_blank')
+            print >> file, '</td>'
+            print >> file, '<td>' + str(row[1]) + '</td>'
+            print >> file, '<td>'
+            
+            if self.iprstat.settings.usegolookup(): cell3 = row[4]
+            else: cell3 = row[2]
+            print >> file, self.__get_link__(cell3, row[6], '_blank')
+            
+            print >> file, '</td>'
+            print >> file, '</tr>'
 
         print >> file, '</table>'
     
@@ -233,21 +224,14 @@ class xls:
         sheet.write(0, 6, "GO Link")
         
         # Write a row to the spreadsheet for each row in iprstatsdata
-        length = self.cache.get_match_length(app)
-        for r in range(length):
-            row = self.cache.get_one_row(app, r)
-            if row:
-                sheet.write(r+1, 0, str(row[1])) # Count
-                sheet.write(r+1, 1, row[0])      # DB Name
-                sheet.write(r+1, 2, row[3])      # DB ID
-                sheet.write(r+1, 3, row[4])      # GO Name
-                sheet.write(r+1, 4, row[2])      # GO ID
-                sheet.write(r+1, 5, self.cache.get_url(app, r)) # DB URL
-                sheet.write(r+1, 6, self.cache.get_url(app, r, True))#GO URL
-                if len(row) == 7:
-                    sheet.write(r, 7, row[6]) # GO Definition
-            else:
-                break
+        for r, row in enumerate(self.cache.iter_rows(app)):
+            sheet.write(r+1, 0, str(row[1])) # Count
+            sheet.write(r+1, 1, row[0])      # DB Name
+            sheet.write(r+1, 2, row[3])      # DB ID
+            sheet.write(r+1, 3, row[4])      # GO Name
+            sheet.write(r+1, 4, row[2])      # GO ID
+            sheet.write(r+1, 5, row[5])      # DB URL
+            sheet.write(r+1, 6, row[6])      # GO URL
     
     def export(self, app=None, filename=None):
         """Exports IPRStatsData as a spreadsheet
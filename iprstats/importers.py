@@ -2,6 +2,7 @@
 import os
 import sys
 import time
+import traceback
 
 try: import MySQLdb
 except ImportError:
@@ -13,11 +14,29 @@ except ImportError:
     print "You must have SQLite3 for Python installed."
     sys.exit(2)
 
+import re
+import bz2
+import zlib
 import shutil
+import urllib
+import multiprocessing
+from cStringIO import StringIO
 from threading import Thread
 from xml.sax import ContentHandler, make_parser
 from xml.sax.handler import feature_namespaces
 
+try: import lzma
+except ImportError:
+    try: from backports import lzma
+    except ImportError:
+        lzma = None
+
+try: from lxml.etree import iterparse
+except ImportError:
+    try: from xml.etree.cElementTree import iterparse
+    except ImportError:
+        from xml.etree.ElementTree import iterparse
+
 '''
 class ProteinAnnotation:
     def __init__(self, id):
@@ -27,55 +46,392 @@ class ProteinAnnotation:
     def __getitem__(self):
         return id
 '''
-class EBIXML(ContentHandler):
+# Session tables written by the importers, in the order their buffered
+# rows are flushed: (table, insert command, columns)
+TABLES = [
+    ('dictionary', 'INSERT INTO',
+        ('code', 'value')),
+    ('match', 'INSERT INTO',
+        ('match_key', 'match_id')),
+    ('protein', 'INSERT INTO',
+        ('protein_key', 'protein_id', 'length', 'crc64', 'nprot')),
+    ('interpro', 'INSERT %(IGNORE)s INTO',
+        ('interpro_key', 'interpro_id', 'name', 'ipr_type')),
+    ('protein_interpro', 'INSERT %(IGNORE)s INTO',
+        ('protein_key', 'interpro_key')),
+    ('protein_interpro_match', 'INSERT INTO',
+        ('pim_id', 'protein_key', 'interpro_key', 'match_key')),
+    ('iprmatch', 'INSERT %(IGNORE)s INTO',
+        ('match_key', 'pim_id', 'name', 'db_name')),
+    ('location', 'INSERT INTO',
+        ('match_key', 'pim_id', 'start_p', 'end_p', 'score', 'status',
+         'evidence')),
+    ('protein_classification', 'INSERT INTO',
+        ('protein_key', 'class_id', 'class_type'))]
 
-    def __init__(self,settings):
-        self.protein = {}
-        self.interpro = {}
-        self.match = {}
-        self.location = {}
+# Protein, match and InterPro identifiers are stored once, in the
+# table of their kind, under dense integer keys that the other tables
+# reference: {kind: (table, key column, identifier column)}.  Importers
+# leave the key out of the rows of these tables; the match table is
+# only written by the SessionWriter.
+IDENTIFIERS = {
+    'protein': ('protein', 'protein_key', 'protein_id'),
+    'interpro': ('interpro', 'interpro_key', 'interpro_id'),
+    'match': ('match', 'match_key', 'match_id')}
 
-        self.class_id = ''
-        self.class_type = ''
-        
-        self.settings = settings
+# Columns that reference an identifier by its key; importers give
+# them the identifier itself: (table, column, kind, schema 3 column)
+KEY_COLUMNS = [
+    ('protein_interpro', 'protein_key', 'protein', 'protein_id'),
+    ('protein_interpro', 'interpro_key', 'interpro', 'interpro_id'),
+    ('protein_interpro_match', 'protein_key', 'protein', 'protein_id'),
+    ('protein_interpro_match', 'interpro_key', 'interpro', 'interpro_id'),
+    ('protein_interpro_match', 'match_key', 'match', 'match_id'),
+    ('iprmatch', 'match_key', 'match', 'id'),
+    ('location', 'match_key', 'match', 'match_id'),
+    ('protein_classification', 'protein_key', 'protein', 'protein_id')]
 
-        self.in_protein = False
-        self.in_interpro = False
-        self.in_match = False
-        self.in_location = False
-        self.in_classification = False
-        self.outpath = self.settings.getsessiondir()
-        sqlfilepath = os.path.join(self.outpath, 'iprsql.sql')
-        self.outfile = open(sqlfilepath,'w')
+# Low-cardinality columns stored as integer codes of the session's
+# dictionary table: (table, column, column type)
+ENCODED_COLUMNS = [
+    ('interpro', 'ipr_type', 'int(10) DEFAULT NULL'),
+    ('iprmatch', 'db_name', 'int(10) DEFAULT NULL'),
+    ('location', 'status', 'int(10) DEFAULT NULL'),
+    ('location', 'evidence', 'int(10) DEFAULT NULL'),
+    ('protein_classification', 'class_type', 'int(10) NOT NULL')]
+
+# Same as in structure.sql, for sessions upgraded from schema 2 and 3
+DICTIONARY_TABLE = "CREATE TABLE `%(SESSION)s_dictionary` ( `code` int(10) " \
+                   "NOT NULL, `value` varchar(80) NOT NULL, PRIMARY KEY " \
+                   "(`code`) );"
+MATCH_TABLE = "CREATE TABLE `%(SESSION)s_match` ( `match_key` integer NOT " \
+              "NULL, `match_id` varchar(25) NOT NULL, PRIMARY KEY " \
+              "(`match_key`), UNIQUE (`match_id`) );"
 
+# Version of the session schema; sessions created before the version
+# marker existed are version 1
+SCHEMA_VERSION = 4
+
+# Secondary indexes for the Cache aggregate queries, created after the
+# session tables have been bulk loaded
+INDEXES = [
+    "CREATE INDEX `%(SESSION)s_iprmatch_db_name` ON `%(SESSION)s_iprmatch` "
+        "(`db_name`, `match_key`, `name`, `pim_id`);",
+    "CREATE INDEX `%(SESSION)s_protein_classification_protein` ON "
+        "`%(SESSION)s_protein_classification` (`protein_key`, `class_id`);",
+    "CREATE INDEX `%(SESSION)s_protein_interpro_match_protein` ON "
+        "`%(SESSION)s_protein_interpro_match` (`protein_key`);",
+    "CREATE INDEX `%(SESSION)s_location_pim_id` ON `%(SESSION)s_location` "
+        "(`pim_id`);"]
+INDEX_NAME = re.compile(r'CREATE INDEX `([^`]+)` ON `([^`]+)`')
+
+# Escape sequences of the bulk load spool files
+SPOOL_ESCAPE = re.compile(r'\\(.)')
+SPOOL_UNESCAPED = {'n':'\n', 't':'\t'}
+
+# Progress of the import of each input file, rewritten in the
+# transaction of every flush so that an interrupted import can be
+# resumed after its last commit
+CHECKPOINT_TABLE = "CREATE TABLE IF NOT EXISTS `%(SESSION)s_checkpoint` ( " \
+                   "`source` varchar(255) NOT NULL, `size` bigint NOT NULL, " \
+                   "`proteins` int(10) NOT NULL, `pim_id` int(10) NOT NULL, " \
+                   "`offset` bigint DEFAULT NULL, `finished` int(1) NOT NULL );"
+
+# File in the session directory naming the input files of an import
+# that has not finished
+RESUME_MARKER = 'ingest.resume'
+
+def get_schema_version(db_con, session):
+    '''Returns: the schema version recorded for the session (int)
+    '''
+    cursor = db_con.cursor()
+    try:
+        cursor.execute("SELECT MAX(version) FROM `%s_schema`;" % (session))
+        version = cursor.fetchone()[0] or 1
+    except:
+        version = 1
+    cursor.close()
+    return version
+
+def upgrade_schema(db_con, session):
+    '''Bring the tables of a session created with an older schema
+       up to SCHEMA_VERSION in place and record the new version.
+    '''
+    version = get_schema_version(db_con, session)
+    if version >= SCHEMA_VERSION:
+        return
+    
+    cursor = db_con.cursor()
+    if version < 3:
+        encode_columns(db_con, session)
+    if version < 4:
+        add_keys(db_con, session)
+    create_indexes(db_con, session)
+    
+    record_schema_version(cursor, session)
+    db_con.commit()
+    cursor.close()
+
+def record_schema_version(cursor, session):
+    '''Mark the session tables as being of SCHEMA_VERSION.
+    '''
+    try: cursor.execute("CREATE TABLE `%s_schema` ( `version` int(10) "
+                        "NOT NULL );" % (session))
+    except: pass
+    cursor.execute("INSERT INTO `%s_schema` (version) VALUES (%d);" %
+                   (session, SCHEMA_VERSION))
+
+def encode_columns(db_con, session):
+    '''Replace the values of the ENCODED_COLUMNS of a session by
+       their codes in a new dictionary table.
+    '''
+    sqlite = isinstance(db_con, sqlite3.Connection)
+    cursor = db_con.cursor()
+    cursor.execute(DICTIONARY_TABLE % {'SESSION':session})
+    
+    values = set()
+    for table, column, _ in ENCODED_COLUMNS:
+        cursor.execute("SELECT DISTINCT `%s` FROM `%s_%s` WHERE `%s` IS "
+                       "NOT NULL;" % (column, session, table, column))
+        values.update([value for (value, ) in cursor.fetchall()])
+    cursor.executemany("INSERT INTO `%s_dictionary` (code, value) VALUES "
+                       "(%s, %s);" % ((session, ) + (sqlite and ('?', '?') or
+                                                     ('%s', '%s'))),
+                       list(enumerate(sorted(values), 1)))
+    
+    for table, column, definition in ENCODED_COLUMNS:
+        cursor.execute("UPDATE `%(SESSION)s_%(TABLE)s` SET `%(COLUMN)s` = "
+                       "(SELECT code FROM `%(SESSION)s_dictionary` WHERE "
+                       "value = `%(SESSION)s_%(TABLE)s`.`%(COLUMN)s`);" %
+                       {'SESSION':session, 'TABLE':table, 'COLUMN':column})
+        if not sqlite: # SQLite columns take the codes as they are
+            cursor.execute("ALTER TABLE `%s_%s` MODIFY `%s` %s;" %
+                           (session, table, column, definition))
+    db_con.commit()
+    cursor.close()
+
+def add_keys(db_con, session):
+    '''Number the proteins, InterPro entries and matches of a session
+       and add key columns that reference them by number next to the
+       identifier columns of the older schema.  The indexes on the
+       older columns are dropped.
+    '''
+    sqlite = isinstance(db_con, sqlite3.Connection)
+    cursor = db_con.cursor()
+    drop_indexes(db_con, session)
+    
+    cursor.execute(MATCH_TABLE % {'SESSION':session})
+    cursor.execute("""
+        SELECT match_id FROM `%(SESSION)s_protein_interpro_match`
+        UNION SELECT id FROM `%(SESSION)s_iprmatch`
+        UNION SELECT match_id FROM `%(SESSION)s_location`;""" %
+        {'SESSION':session})
+    matches = sorted([match_id for (match_id, ) in cursor.fetchall()
+                      if match_id is not None])
+    cursor.executemany("INSERT INTO `%s_match` (match_key, match_id) VALUES "
+                       "(%s, %s);" % ((session, ) + (sqlite and ('?', '?') or
+                                                     ('%s', '%s'))),
+                       list(enumerate(matches, 1)))
+    
+    for table in ('protein', 'interpro'):
+        cursor.execute("ALTER TABLE `%s_%s` ADD COLUMN `%s_key` int(10);" %
+                       (session, table, table))
+        if sqlite:
+            cursor.execute("UPDATE `%s_%s` SET `%s_key` = rowid;" %
+                           (session, table, table))
+        else:
+            cursor.execute("SET @key = 0;")
+            cursor.execute("UPDATE `%s_%s` SET `%s_key` = (@key := @key + 1);"
+                           % (session, table, table))
+    
+    for table, column, kind, old_column in KEY_COLUMNS:
+        ident_table, key, ident = IDENTIFIERS[kind]
+        cursor.execute("ALTER TABLE `%s_%s` ADD COLUMN `%s` int(10);" %
+                       (session, table, column))
+        cursor.execute("UPDATE `%(SESSION)s_%(TABLE)s` SET `%(COLUMN)s` = "
+                       "(SELECT `%(KEY)s` FROM `%(SESSION)s_%(IDTABLE)s` "
+                       "WHERE `%(ID)s` = `%(SESSION)s_%(TABLE)s`."
+                       "`%(OLD)s`);" % {'SESSION':session, 'TABLE':table,
+                       'COLUMN':column, 'KEY':key, 'IDTABLE':ident_table,
+                       'ID':ident, 'OLD':old_column})
+    db_con.commit()
+    cursor.close()
+
+def create_indexes(db_con, session):
+    '''Create the secondary indexes of the session tables.
+    '''
+    cursor = db_con.cursor()
+    for statement in INDEXES:
+        try: cursor.execute(statement % {'SESSION':session})
+        except: pass # index already exists
+    cursor.close()
+
+def drop_indexes(db_con, session):
+    '''Drop the secondary indexes of the session tables, e.g.
+       before more rows are bulk loaded into them.
+    '''
+    sqlite = isinstance(db_con, sqlite3.Connection)
+    cursor = db_con.cursor()
+    for statement in INDEXES:
+        index, table = INDEX_NAME.match(statement %
+                                        {'SESSION':session}).groups()
+        try:
+            if sqlite:
+                cursor.execute("DROP INDEX `%s`;" % (index))
+            else:
+                cursor.execute("DROP INDEX `%s` ON `%s`;" % (index, table))
+        except: pass # index doesn't exist yet
+    cursor.close()
+
+def read_schema_version(structpath):
+    '''Returns: the schema version in the header of a structure.sql
+       file, or 1 if it has none (int)
+    '''
+    structfile = open(structpath, 'r')
+    header = structfile.readline().split()
+    structfile.close()
+    if header[:1] == ['--'] and header[-1].isdigit():
+        return int(header[-1])
+    return 1
+
+class SessionWriter:
+    '''Buffers rows parsed from InterProScan output and writes them
+       to the session tables of the local database (SQLite or MySQL).
+       Callers flush the buffer with one executemany per table once
+       isfull() reports batch_size pending rows, and each flush is
+       committed as its own transaction.  Flushes come between
+       proteins: the writer keeps the keys of the InterPro entries and
+       matches, but only those of the proteins buffered since the last
+       flush.
+       
+       With the 'bulk_load' setting a MySQL session is instead
+       spooled to one tab-separated file per table in the session
+       directory, which close() loads with LOAD DATA LOCAL INFILE
+       while the table keys are disabled.  If the server refuses
+       LOAD DATA LOCAL the spool files are inserted with multi-row
+       executemany batches.
+       
+       Once set_source() names the input file, every flush also
+       records a checkpoint of that file (proteins committed, pim_id
+       high-water mark and, for sharded parses, the byte offset
+       reached) in the same transaction as the rows.  Bulk loads are
+       only committed by close(), so they write no checkpoints.
+       
+       Importers ask is_duplicate() before writing a protein, so that
+       a protein in several input files of a session is written once.
+       It looks the protein up in the protein table rather than
+       keeping the identifiers imported so far.
+    '''
+    
+    def __init__(self, settings, batch_size=None):
+        '''Open a connection to the local database given by the
+           settings object.  batch_size defaults to the 'batch_size'
+           setting of the [import] section.
+        '''
+        self.settings = settings
+        self.session = self.settings.getsession()
+        
+        if batch_size is None:
+            batch_size = self.settings.getbatchsize()
+        self.batch_size = max(1, batch_size)
+        
         if self.settings.usesqlite():
             self.ignorecmd = "OR IGNORE"
             self.autoincrement = ""
+            self.param = "?"
             sqldb = os.path.join(self.settings.getsessiondir(),
                                  self.settings.getlocaldb().getdb())
-            print sqldb
             self.db_con = sqlite3.connect(sqldb)
         else:
             self.ignorecmd = "IGNORE"
             self.autoincrement = " AUTO_INCREMENT"
-            
+            self.param = "%s"
             dbsettings = self.settings.getlocaldb()
             self.db_con = MySQLdb.connect(
                             db=dbsettings.getdb(),
                             host=dbsettings.gethost(),
                             user=dbsettings.getuser(),
-                            passwd=dbsettings.getpasswd())
+                            passwd=dbsettings.getpasswd(),
+                            port=dbsettings.getport(),
+                            local_infile=1)
         self.db_cursor = self.db_con.cursor()
+        
+        # Spool files of a MySQL bulk load, by table
+        self.spools = None
+        if not self.settings.usesqlite() and self.settings.usebulkload():
+            self.spools = {}
+        
+        self.statements = {}
+        self.rows = {}
+        self.written = {}
+        self.elapsed = {}
+        for table, command, columns in TABLES:
+            self.statements[table] = '%s `%s_%s` (%s) VALUES (%s)' % (
+                    command % {'IGNORE':self.ignorecmd},
+                    self.session, table, ', '.join(columns),
+                    ', '.join([self.param] * len(columns)))
+            self.rows[table] = []
+            self.written[table] = 0
+            self.elapsed[table] = 0.0
+        self.pending = 0
+        self.started = time.time()
+        
+        # (path, size) of the input file and the checkpoint to write
+        # with the next flush
+        self.source = None
+        self.checkpoint_row = None
+        
+        # Proteins keyed after source_key come from the current input
+        # file; those keyed up to it were imported before it
+        self.source_key = 0
+        self.duplicates = 0
+        self.conflicts = 0
+        
+        # Positions of the dictionary-encoded and key columns in the
+        # rows of each table, the codes of the values seen so far and
+        # the keys of the identifiers seen so far.  Proteins are too
+        # many to keep: only the keys of those buffered since the last
+        # flush are kept, and the others are looked up in the protein
+        # table by protein_lookup.
+        columns = dict([(table, list(cols)) for table, _, cols in TABLES])
+        self.encoded = dict([(table, []) for table, _, _ in TABLES])
+        for table, column, _ in ENCODED_COLUMNS:
+            self.encoded[table].append(columns[table].index(column))
+        self.keyed = dict([(table, []) for table, _, _ in TABLES])
+        for table, column, kind, _ in KEY_COLUMNS:
+            self.keyed[table].append((columns[table].index(column), kind))
+        self.identified = dict([(table, kind) for kind, (table, _, _) in
+                                IDENTIFIERS.items() if kind != 'match'])
+        self.codes = {}
+        self.keys = dict([(kind, {}) for kind in IDENTIFIERS])
+        self.protein_key = 0
+        self.protein_lookup = "SELECT protein_key, crc64 FROM `%s_protein` " \
+                              "WHERE protein_id = %s;" % (self.session,
+                                                          self.param)
         try:
-            self.db_cursor.execute(
-                        "SELECT MAX(pim_id) FROM protein_interpro_match;")
-            self.pim_id = self.db_cursor.fetchall()[0][0]
+            self.db_cursor.execute("SELECT value, code FROM "
+                                   "`%s_dictionary`;" % (self.session))
+            self.codes = dict(self.db_cursor.fetchall())
+            for kind, (table, key, ident) in IDENTIFIERS.items():
+                if kind == 'protein':
+                    continue
+                self.db_cursor.execute("SELECT `%s`, `%s` FROM `%s_%s`;" %
+                                       (ident, key, self.session, table))
+                self.keys[kind] = dict(self.db_cursor.fetchall())
+            self.db_cursor.execute("SELECT MAX(protein_key) FROM "
+                                   "`%s_protein`;" % (self.session))
+            self.protein_key = self.db_cursor.fetchone()[0] or 0
+            self.source_key = self.protein_key
         except:
-            self.pim_id = 1
-            
+            pass # new session
+    
+    def create_tables(self):
+        '''Create the session tables from structure.sql, copying
+           it to the data directory first if necessary.
+        '''
         structpath = os.path.join(self.settings.getdatadir(), 'structure.sql')
-        if not os.path.exists(structpath):
+        if not os.path.exists(structpath) or \
+                read_schema_version(structpath) < SCHEMA_VERSION:
             if os.path.exists('structure.sql'):
                 shutil.copyfile('structure.sql',structpath)
             elif os.path.exists(os.path.join(
@@ -83,19 +439,455 @@ class EBIXML(ContentHandler):
                 shutil.copyfile(
                         os.path.join(self.settings.getinstalldir(),
                                        'structure.sql'), structpath)
-            else:
+            elif not os.path.exists(structpath):
                 print "iprstats: import error: can't find structure.sql"
                 sys.exit(2)
-                
+        
         db_struct = open(structpath,'r')
         struct_sql = db_struct.read() % (
-                    {'SESSION':self.settings.getsession(),
+                    {'SESSION':self.session,
                      'AUTO':self.autoincrement})
-        print >> self.outfile, struct_sql
-        self.outfile.flush()
+        db_struct.close()
+        for statement in struct_sql.splitlines():
+            if statement.strip() and not statement.startswith('--'):
+                self.db_cursor.execute(statement)
+        self.db_cursor.execute(CHECKPOINT_TABLE % {'SESSION':self.session})
+        record_schema_version(self.db_cursor, self.session)
+        self.db_con.commit()
+    
+    def drop_tables(self):
+        '''Drop the session tables, along with the keys and
+           dictionary codes read from them.
+        '''
+        tables = [table for table, _, _ in TABLES]
+        for table in tables + ['schema', 'checkpoint']:
+            self.db_cursor.execute("DROP TABLE IF EXISTS `%s_%s`;" %
+                                   (self.session, table))
+        self.db_con.commit()
+        self.codes = {}
+        self.keys = dict([(kind, {}) for kind in IDENTIFIERS])
+        self.protein_key = 0
+        self.source_key = 0
+    
+    def set_source(self, filename):
+        '''Start importing the given input file: record checkpoints
+           of its import with every flush, and count the proteins
+           imported so far as duplicates if it has them too.  The
+           files spooled for a bulk load so far are loaded first, so
+           that their proteins can be looked up.
+        '''
+        if self.spools:
+            self.__load_spools__()
+            self.spools = {}
+        self.source = (os.path.abspath(filename), os.path.getsize(filename))
+        self.checkpoint_row = None
+        self.source_key = self.protein_key
+    
+    def finish_source(self):
+        '''Flush the rows of the current input file and mark its
+           checkpoint finished.
+        '''
+        self.flush()
+        if self.checkpoint_row is not None:
+            self.__write_checkpoint__(finished=1)
+            self.db_con.commit()
+        self.source = None
+        self.checkpoint_row = None
+    
+    def is_duplicate(self, protein_id, crc64):
+        '''Returns: whether the protein was already imported from an
+           earlier input file, or before an interrupted import was
+           resumed, in which case its rows are left out (bool)
+           Raises ValueError if the protein was already given by the
+           current input file, apart from its other rows.
+           
+           Proteins are looked up in the protein table; a new protein
+           is given its key.
+        '''
+        keys = self.keys['protein']
+        row = None
+        if protein_id not in keys:
+            self.db_cursor.execute(self.protein_lookup, (protein_id, ))
+            row = self.db_cursor.fetchone()
+            if row is None:
+                self.protein_key += 1
+                keys[protein_id] = self.protein_key
+                return False
+        if row is None or row[0] > self.source_key:
+            raise ValueError, "Protein %s appears more than once in " \
+                "%s; the rows of a protein must be next to each other " \
+                "(sort the file by protein)" % (protein_id,
+                self.source and self.source[0] or "the input file")
+        self.duplicates += 1
+        known = row[1]
+        if crc64 and known and crc64 != known:
+            self.conflicts += 1
+        return True
+    
+    def checkpoint(self, proteins, pim_id, offset=None):
+        '''Write a checkpoint with the next flush: the number of
+           proteins and the highest pim_id it commits, and the byte
+           offset of the input file the import has reached, if known.
+        '''
+        if self.source is not None and self.spools is None:
+            self.checkpoint_row = self.source + (proteins, pim_id, offset)
+    
+    def get_checkpoint(self, filename):
+        '''Returns: the last checkpoint of the given input file as a
+           dict with the keys source, size, proteins, pim_id, offset
+           and finished, or None if there is none (dict)
+        '''
+        try:
+            self.db_cursor.execute("SELECT source, size, proteins, pim_id, "
+                                   "`offset`, finished FROM "
+                                   "`%s_checkpoint` WHERE source = %s;" %
+                                   (self.session, self.param),
+                                   (os.path.abspath(filename), ))
+            row = self.db_cursor.fetchone()
+        except:
+            row = None
+        if row is None:
+            return None
+        return dict(zip(('source', 'size', 'proteins', 'pim_id', 'offset',
+                         'finished'), row))
+    
+    def __write_checkpoint__(self, finished=0):
+        '''Replace the checkpoint row of the current input file;
+           the caller commits it.
+        '''
+        self.db_cursor.execute("DELETE FROM `%s_checkpoint` WHERE source "
+                               "= %s;" % (self.session, self.param),
+                               self.checkpoint_row[:1])
+        self.db_cursor.execute("INSERT INTO `%s_checkpoint` (source, size, "
+                               "proteins, pim_id, `offset`, finished) VALUES "
+                               "(%s)" % (self.session,
+                               ', '.join([self.param] * 6)),
+                               self.checkpoint_row + (finished, ))
+    
+    def get_max_pim_id(self):
+        '''Returns: the highest pim_id already stored in the
+           session, or 1 if there is none (int)
+        '''
+        try:
+            self.db_cursor.execute(
+                        "SELECT MAX(pim_id) FROM `%s_protein_interpro_match`;"
+                        % (self.session))
+            pim_id = self.db_cursor.fetchall()[0][0]
+        except:
+            pim_id = None
+        if pim_id is None:
+            pim_id = 1
+        return pim_id
+    
+    def add(self, table, row):
+        '''Buffer a row (tuple ordered as the columns in TABLES)
+           for the given session table.
+        '''
+        self.rows[table].append(self.__encode__(table, row))
+        self.pending += 1
+    
+    def extend(self, table, rows):
+        '''Buffer a list of rows for the given session table.
+        '''
+        encode = self.__encode__
+        self.rows[table].extend([encode(table, row) for row in rows])
+        self.pending += len(rows)
+    
+    def __encode__(self, table, row):
+        '''Give a row the key of the protein or InterPro entry it
+           describes, replace the identifiers in its key columns by
+           their keys and the values of its encoded columns by their
+           dictionary codes.
+           Returns: row (list)
+        '''
+        row = list(row)
+        if table in self.identified:
+            kind = self.identified[table]
+            row.insert(0, self.keys[kind].get(row[0]) or
+                          self.__key__(kind, row[0]))
+        for index, kind in self.keyed[table]:
+            row[index] = self.keys[kind].get(row[index]) or \
+                         self.__key__(kind, row[index])
+        for index in self.encoded[table]:
+            value = row[index]
+            if value is not None:
+                code = self.codes.get(value)
+                if code is None:
+                    code = self.codes[value] = len(self.codes) + 1
+                    self.rows['dictionary'].append((code, value))
+                    self.pending += 1
+                row[index] = code
+        return row
+    
+    def __key__(self, kind, identifier):
+        '''Returns: the key of a protein, InterPro or match
+           identifier, numbering new identifiers in the order they
+           are seen (int)
+        '''
+        if identifier is None:
+            return None
+        keys = self.keys[kind]
+        key = keys.get(identifier)
+        if key is None:
+            if kind == 'protein':
+                key = keys[identifier] = self.__protein_key__(identifier)
+                return key
+            key = keys[identifier] = len(keys) + 1
+            if kind == 'match':
+                self.rows['match'].append((key, identifier))
+                self.pending += 1
+        return key
+    
+    def __protein_key__(self, protein_id):
+        '''Returns: the key of a protein that was flushed before,
+           from the protein table, or the next key for a new
+           protein (int)
+        '''
+        self.db_cursor.execute(self.protein_lookup, (protein_id, ))
+        row = self.db_cursor.fetchone()
+        if row:
+            return row[0]
+        self.protein_key += 1
+        return self.protein_key
+    
+    def isfull(self):
+        '''Returns: whether batch_size rows are waiting to be
+           flushed (bool)
+        '''
+        return self.pending >= self.batch_size
+    
+    def flush(self):
+        '''Write all buffered rows with executemany and commit them
+           along with the pending checkpoint, or append them to the
+           spool files of a bulk load.
+        '''
+        if not self.pending and self.checkpoint_row is None:
+            return
+        for table, command, columns in TABLES:
+            rows = self.rows[table]
+            if rows:
+                start = time.time()
+                if self.spools is not None:
+                    self.__spool__(table, rows)
+                else:
+                    self.db_cursor.executemany(self.statements[table], rows)
+                self.elapsed[table] += time.time() - start
+                self.written[table] += len(rows)
+                self.rows[table] = []
+        self.keys['protein'] = {}
+        if self.spools is None:
+            if self.checkpoint_row is not None:
+                self.__write_checkpoint__()
+            self.db_con.commit()
+        self.pending = 0
+    
+    def __spool__(self, table, rows):
+        '''Append rows to the spool file of a table in the format
+           LOAD DATA reads by default: tab-separated, backslash
+           escaped and \\N for NULL.
+        '''
+        if table not in self.spools:
+            self.spools[table] = open(os.path.join(
+                    self.settings.getsessiondir(), table + '.tsv'), 'wb')
+        lines = []
+        for row in rows:
+            fields = []
+            for value in row:
+                if value is None:
+                    fields.append('\\N')
+                elif isinstance(value, basestring):
+                    if isinstance(value, unicode):
+                        value = value.encode('utf-8')
+                    fields.append(value.replace('\\', '\\\\').replace(
+                            '\t', '\\t').replace('\n', '\\n'))
+                elif isinstance(value, float):
+                    fields.append(repr(value))
+                else:
+                    fields.append(str(value))
+            lines.append('\t'.join(fields))
+        self.spools[table].write('\n'.join(lines) + '\n')
+    
+    def __load_spools__(self):
+        '''Load the spool files into the session tables with the
+           secondary indexes dropped and the table keys disabled.
+        '''
+        drop_indexes(self.db_con, self.session)
+        for table, command, columns in TABLES:
+            if table not in self.spools:
+                continue
+            spool = self.spools.pop(table)
+            spool.close()
+            
+            start = time.time()
+            name = '`%s_%s`' % (self.session, table)
+            self.db_cursor.execute("ALTER TABLE %s DISABLE KEYS;" % (name))
+            if command.startswith('REPLACE'):
+                modifier = 'REPLACE'
+            elif 'IGNORE' in command:
+                modifier = 'IGNORE'
+            else:
+                modifier = ''
+            try:
+                self.db_cursor.execute(
+                    "LOAD DATA LOCAL INFILE %%s %s INTO TABLE %s "
+                    "CHARACTER SET utf8 (%s);" % (modifier, name,
+                    ', '.join(columns)), (spool.name, ))
+            except MySQLdb.DatabaseError, e:
+                print "iprstats: LOAD DATA LOCAL INFILE failed (%s); " \
+                      "inserting %s in batches" % (e, table)
+                self.__insert_spool__(table, spool.name)
+            self.db_cursor.execute("ALTER TABLE %s ENABLE KEYS;" % (name))
+            self.db_con.commit()
+            self.elapsed[table] += time.time() - start
+            os.remove(spool.name)
+        self.spools = None
+        create_indexes(self.db_con, self.session)
+    
+    def __insert_spool__(self, table, filename):
+        '''Insert the rows of a spool file with executemany, which
+           MySQLdb sends as multi-row INSERT statements.
+        '''
+        def unescape(field):
+            if field == '\\N':
+                return None
+            return SPOOL_ESCAPE.sub(lambda match: SPOOL_UNESCAPED.get(
+                    match.group(1), match.group(1)), field).decode('utf-8')
+        
+        spool = open(filename, 'rb')
+        while True:
+            lines = spool.readlines(1 << 20)
+            if not lines:
+                break
+            self.db_cursor.executemany(self.statements[table],
+                    [[unescape(field) for field in
+                      line.rstrip('\n').split('\t')] for line in lines])
+        spool.close()
+    
+    def abort(self):
+        '''Drop the rows that have not been committed and close the
+           spool files and the connection, after an import failed.
+        '''
+        self.db_con.rollback()
+        for spool in (self.spools or {}).values():
+            spool.close()
+        self.db_con.close()
+    
+    def close(self):
+        '''Flush the remaining rows, load any spool files, build
+           the indexes, mark the checkpoint finished, close the cursor
+           and print the ingest throughput of each table.
+        '''
+        self.finish_source()
+        if self.spools is not None:
+            self.__load_spools__()
+        else:
+            create_indexes(self.db_con, self.session)
+        self.db_cursor.close()
+        
+        if not self.settings.usesqlite():
+            log = open(os.path.join(self.settings.getsessiondir(),
+                                    'tbl_creation.log'), 'a')
+            log.write(str(time.ctime()) + "\t" + self.session + "\n")
+            log.close()
+        
+        total = time.time() - self.started
+        print "iprstats: imported %d rows in %.2fs" % (
+                    sum(self.written.values()), total)
+        if self.duplicates:
+            print "iprstats: left out %d proteins imported before " \
+                  "(%d with a different crc64)" % (self.duplicates,
+                                                   self.conflicts)
+        for table, command, columns in TABLES:
+            if self.elapsed[table] > 0:
+                rate = self.written[table] / self.elapsed[table]
+            else:
+                rate = 0.0
+            print "    %-24s %9d rows %12.0f rows/s" % (
+                    table, self.written[table], rate)
+
+class RowCollector:
+    '''Stand-in for SessionWriter used by worker processes: it
+       keeps every row in memory so that the rows can be sent back
+       to the process that writes the session tables.  The rows keep
+       their strings; the SessionWriter encodes them as they are
+       merged.
+    '''
+    
+    def __init__(self):
+        self.rows = dict([(table, []) for table, _, _ in TABLES])
+        
+        # (protein id, crc64, number of rows of each table in TABLES
+        # order) after each protein, so that the rows of a duplicate
+        # protein can be left out when the rows are merged
+        self.marks = []
+    
+    def get_max_pim_id(self):
+        '''Shards number their matches from 1; the writer shifts
+           them into the session's pim_id range.
+        '''
+        return 0
+    
+    def add(self, table, row):
+        self.rows[table].append(row)
+        if table == 'protein':
+            self.marks.append((row[0], row[2], [len(self.rows[name])
+                                                for name, _, _ in TABLES]))
+    
+    def checkpoint(self, proteins, pim_id, offset=None):
+        pass
+    
+    def is_duplicate(self, protein_id, crc64):
+        return False
+    
+    def isfull(self):
+        return False
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        pass
+
+class EBIXML(ContentHandler):
+    '''SAX handler that turns InterProScan XML into session table rows.
+       Rows are committed in chunks of whole <protein> elements while
+       the parse is still running, so the tables can be queried and
+       memory use stays bounded by the writer's batch size.  progress,
+       if given, is called with the number of proteins committed so far
+       after every chunk.  Proteins the writer reports as duplicates
+       are counted but not written; their matches still use up
+       pim_ids.  A writer created by the handler is closed at the end
+       of the document.
+    '''
+
+    def __init__(self, settings, writer=None, progress=None):
+        self.protein = {}
+        self.interpro = {}
+        self.match = {}
+        self.location = {}
+
+        self.class_id = ''
+        self.class_type = ''
         
-        if self.pim_id is None:
-            self.pim_id = 1
+        self.settings = settings
+
+        self.in_protein = False
+        self.in_interpro = False
+        self.in_match = False
+        self.in_location = False
+        self.in_classification = False
+        self.duplicate = False
+        
+        self.closewriter = writer is None
+        if writer is None:
+            writer = SessionWriter(self.settings)
+            writer.create_tables()
+        self.writer = writer
+        self.pim_id = self.writer.get_max_pim_id()
+        
+        self.progress = progress
+        self.proteins = 0
+        self.ingested = 0
 
     def startElement(self, name, attrs):
         if name == "protein":
@@ -103,6 +895,8 @@ class EBIXML(ContentHandler):
             self.protein = {'id': attrs.get('id',None),
                             'length': int(attrs.get('length',None)),
                             'crc64':attrs.get('crc64', None)}
+            self.duplicate = self.writer.is_duplicate(self.protein['id'],
+                                                      self.protein['crc64'])
         elif name in ("interpro", "ipr"):
             self.in_interpro = True
             self.interpro = {'id': attrs.get('id', None),
@@ -128,114 +922,1037 @@ class EBIXML(ContentHandler):
             self.class_type = attrs.get('class_type', None)
             self.class_id = attrs.get('id', None)
     def endElement(self, name):
+        if self.duplicate:
+            add = self.__leave_out__
+        else:
+            add = self.writer.add
         if name == "protein":
             self.in_protein = False
-            sql_string  = 'REPLACE INTO `%s_protein` ' % (
-                                                self.settings.session)
-            sql_string += '(protein_id, length, crc64, nprot) VALUES '
-            sql_string += '("%s", %d, "%s", %d); ' % (
-                       self.protein["id"], self.protein["length"],
-                       self.protein["crc64"], 1)
-            #sql_string += 'ON DUPLICATE KEY UPDATE nprot=nprot+1;'
-            print >> self.outfile, sql_string
-            self.outfile.flush()
+            add('protein', (self.protein["id"],
+                            self.protein["length"], self.protein["crc64"], 1))
+            self.duplicate = False
+            self.proteins += 1
+            if self.writer.isfull():
+                self.commit()
         elif name in ("interpro", "ipr"):
             self.in_interpro = False
-            sql_string  = 'INSERT %s INTO `%s_interpro` ' % (
-                            self.ignorecmd, self.settings.session)
-            sql_string += '(interpro_id, name, ipr_type) '
-            sql_string += 'VALUES ("%s", "%s", "%s");' % (
-                            self.interpro['id'], self.interpro['name'],
-                            self.interpro['type'])
-            sql_string2  = 'INSERT INTO `%s_protein_interpro` ' % (
-                            self.settings.session)
-            sql_string2 += '(protein_id, interpro_id) VALUES '
-            sql_string2 += '("%s", "%s");' % (
-                            self.protein['id'], self.interpro['id'])
-            print >> self.outfile, sql_string
-            print >> self.outfile, sql_string2
+            add('interpro', (self.interpro['id'],
+                            self.interpro['name'], self.interpro['type']))
+            add('protein_interpro', (self.protein['id'],
+                            self.interpro['id']))
         elif name == "match":
             self.in_match = False
-            sql_string = 'INSERT INTO `%s_protein_interpro_match` ' % (
-                     self.settings.session)
-            sql_string += "(pim_id, protein_id, interpro_id, match_id) "
-            
-            sql_string += 'VALUES (%d, "%s", "%s", "%s"); ' % (
-                      self.pim_id, self.protein['id'],
-                      self.interpro['id'], self.match['id'])
-            sql_string2 = 'INSERT %s INTO `%s_iprmatch` ' % (
-                     self.ignorecmd, self.settings.session)
-            sql_string2 += "(id, pim_id, name, db_name) "
-
-            sql_string2 += ' VALUES ("%s", %d, "%s", "%s");' % (
-                                self.match['id'], self.pim_id,
-                                self.match['name'], self.match['dbname'])
-            print >> self.outfile, sql_string
-            print >> self.outfile, sql_string2
+            add('protein_interpro_match', (self.pim_id,
+                            self.protein['id'], self.interpro['id'],
+                            self.match['id']))
+            add('iprmatch', (self.match['id'], self.pim_id,
+                            self.match['name'], self.match['dbname']))
         elif name in ("location", "lcn"):
             self.in_location = False
-            sql_string = 'INSERT INTO `%s_location` ' % (self.settings.session)
-            sql_string += "(loc_id, match_id, pim_id, start_p, "
-            sql_string += "end_p, score, status, evidence) "
-            sql_string += 'VALUES  (NULL, "%s", %d, %d, %d, %e, "%s", "%s");' % (
-                       self.match['id'],
-                       self.pim_id,
-                       self.location['start'],
-                       self.location['end'],
-                       self.location['score'],
-                       self.location['status'],
-                       self.location['evidence'])
-            print >> self.outfile, sql_string
+            add('location', (self.match['id'], self.pim_id,
+                            self.location['start'], self.location['end'],
+                            self.location['score'], self.location['status'],
+                            self.location['evidence']))
         elif name == "classification":
             self.in_classification = False
-            sql_string  = 'INSERT INTO `%s_protein_classification` ' % (
-                          self.settings.session)
-            sql_string += "(id, protein_id, class_id, class_type) "
-            sql_string += 'VALUES (NULL, "%s", "%s", "%s");' % (
-                          self.protein["id"], self.class_id, self.class_type)
-            print >> self.outfile, sql_string
+            add('protein_classification', (self.protein["id"],
+                            self.class_id, self.class_type))
+    
+    def __leave_out__(self, table, row):
+        '''Stands in for writer.add while in a duplicate protein.
+        '''
+        pass
+        
+    def commit(self):
+        '''Write the rows of all completed proteins to the database,
+           with a checkpoint after the last of them, and report the
+           progress.
+        '''
+        self.writer.checkpoint(self.proteins, self.pim_id)
+        self.writer.flush()
+        self.ingested = self.proteins
+        if self.progress:
+            self.progress(self.ingested)
         
     def endDocument(self):
-        # Update the mysql database
-        if self.outfile is not sys.stdout:
-            self.outfile.flush()
-            if self.settings.usesqlite():
-                sqlfile = open(self.outfile.name, 'r')
-                for line in sqlfile:
-                    self.db_cursor.execute(line)
-                self.db_con.commit()
-                self.db_cursor.close()
-                sqlfile.close()
+        # Write the remaining rows to the database
+        self.commit()
+        if self.closewriter:
+            self.writer.close()
+
+# Elements the EBIXML handler acts on
+EBIXML_ELEMENTS = frozenset(['protein', 'interpro', 'ipr', 'match',
+                             'location', 'lcn', 'classification'])
+
+def iterparse_xml(source, handler):
+    '''Drive an EBIXML handler from an iterparse event loop instead
+       of SAX callbacks.  Only the elements the handler acts on are
+       passed to it, with the element's attribute dict standing in for
+       the SAX attributes, so it writes exactly the same rows.  Each
+       <protein> is cleared from the tree once it has been handled.
+    '''
+    startElement = handler.startElement
+    endElement = handler.endElement
+    root = None
+    handler.startDocument()
+    for event, elem in iterparse(source, events=('start', 'end')):
+        if root is None:
+            root = elem
+        tag = elem.tag
+        if tag[0] == '{':
+            tag = tag[tag.index('}') + 1:]
+        if tag not in EBIXML_ELEMENTS:
+            continue
+        if event == 'start':
+            startElement(tag, elem.attrib)
+        else:
+            endElement(tag)
+            if tag == 'protein':
+                elem.clear()
+                root.clear()
+    handler.endDocument()
+
+def parse_xml(source, handler, backend='sax'):
+    '''Parse an XML file name or file object with the given EBIXML
+       handler using the 'sax' or 'iterparse' backend.
+    '''
+    if backend == 'iterparse':
+        iterparse_xml(source, handler)
+    else:
+        # Create a parser
+        parser = make_parser()
+        parser.setFeature(feature_namespaces, 0)
+
+        # Parse file into DB
+        parser.setContentHandler(handler)
+        parser.parse(source)
+        del parser
+
+# InterProScan 5 analysis names and the app names they are stored as
+ANALYSIS_APPS = {
+    'Pfam':'PFAM', 'PIRSF':'PIR', 'Gene3D':'GENE3D', 'Hamap':'HAMAP',
+    'PANTHER':'PANTHER', 'PRINTS':'PRINTS', 'ProDom':'PRODOM',
+    'ProSiteProfiles':'PROFILE', 'ProSitePatterns':'PROSITE',
+    'SMART':'SMART', 'SUPERFAMILY':'SUPERFAMILY', 'TIGRFAM':'TIGRFAMs'}
+
+class InterProScanTabular:
+    '''Base class for the streaming importers of InterProScan's
+       line-based output formats.  Lines are read in chunks of about
+       1MB and split in bulk; the rows of each protein are buffered
+       until the next protein starts and committed in chunks of whole
+       proteins, as EBIXML does, leaving out the proteins the writer
+       reports as duplicates.  The lines of a protein have to be next
+       to each other; the writer stops the import if a protein comes
+       back after others.  Subclasses implement
+       __parse_lines__(self, fields) for a chunk of split lines.
+    '''
+    
+    chunk_size = 1 << 20
+    
+    def __init__(self, settings, writer=None, progress=None):
+        self.settings = settings
+        self.closewriter = writer is None
+        if writer is None:
+            writer = SessionWriter(self.settings)
+            writer.create_tables()
+        self.writer = writer
+        self.pim_id = self.writer.get_max_pim_id()
+        
+        self.progress = progress
+        self.proteins = 0
+        self.ingested = 0
+        self.done = False
+        
+        self.protein = None
+        self.length = None
+        self.duplicate = False
+        self.matches = {}
+        self.interpros = set()
+        self.goids = set()
+    
+    def parse(self, source):
+        '''Import a file name or open file object.
+        '''
+        if isinstance(source, basestring):
+            source = open(source, 'rb')
+        self.done = False
+        while not self.done:
+            lines = source.readlines(self.chunk_size)
+            if not lines:
+                break
+            self.__parse_lines__([line.rstrip('\r\n').split('\t')
+                                  for line in lines])
+        source.close()
+        self.__end_protein__()
+        self.commit()
+        if self.closewriter:
+            self.writer.close()
+    
+    def __parse_lines__(self, fields):
+        '''Turn a chunk of lines, split into their tab-separated
+           fields, into proteins and matches with __start_protein__
+           and __add_match__.  Subclasses override it for their
+           format; lines of no known format are left out.
+        '''
+        pass
+    
+    def __start_protein__(self, protein, length):
+        '''Finish the current protein if protein is a different one.
+        '''
+        if protein != self.protein:
+            self.__end_protein__()
+            self.protein = protein
+            self.duplicate = self.writer.is_duplicate(protein, None)
+        if length is not None:
+            self.length = length
+    
+    def __add_match__(self, analysis, match_id, name, start, end, score,
+                      status, interpro_id, interpro_name, goids):
+        '''Add one match location of the current protein.  Locations
+           of the same signature and InterPro entry share a pim_id.
+        '''
+        if self.duplicate:
+            return
+        if not interpro_id or interpro_id == '-':
+            interpro_id, interpro_name = 'noIPR', 'unintegrated'
+        if interpro_id not in self.interpros:
+            self.interpros.add(interpro_id)
+            self.writer.add('interpro', (interpro_id, interpro_name, None))
+            self.writer.add('protein_interpro', (self.protein, interpro_id))
+        
+        pim_id = self.matches.get((interpro_id, match_id))
+        if pim_id is None:
+            self.pim_id += 1
+            pim_id = self.matches[(interpro_id, match_id)] = self.pim_id
+            self.writer.add('protein_interpro_match', (pim_id,
+                            self.protein, interpro_id, match_id))
+            self.writer.add('iprmatch', (match_id, pim_id,
+                            name.replace('"', ''),
+                            ANALYSIS_APPS.get(analysis, analysis)))
+        
+        try: score = float(score)
+        except ValueError: score = 0.0
+        self.writer.add('location', (match_id, pim_id, int(start), int(end),
+                        score, status, analysis))
+        self.goids.update(goids)
+    
+    def __end_protein__(self):
+        '''Write the protein and classification rows of the current
+           protein and commit if the writer's batch is full.
+        '''
+        if self.protein is None:
+            return
+        if not self.duplicate:
+            for goid in sorted(self.goids):
+                self.writer.add('protein_classification',
+                                (self.protein, goid, 'GO'))
+            self.writer.add('protein', (self.protein, self.length, None, 1))
+        
+        self.protein = None
+        self.length = None
+        self.matches = {}
+        self.interpros = set()
+        self.goids = set()
+        self.proteins += 1
+        if self.writer.isfull():
+            self.commit()
+    
+    def commit(self):
+        '''Write the rows of all completed proteins to the database,
+           with a checkpoint after the last of them, and report the
+           progress.
+        '''
+        self.writer.checkpoint(self.proteins, self.pim_id)
+        self.writer.flush()
+        self.ingested = self.proteins
+        if self.progress:
+            self.progress(self.ingested)
+
+def split_goids(value):
+    '''Split an InterProScan GO column or Ontology_term attribute,
+       e.g. 'GO:0005515(InterPro)|GO:0016020', into accessions.
+    '''
+    if not value or value == '-':
+        return []
+    return [goid.split('(')[0].strip('"')
+            for goid in value.replace(',', '|').split('|') if goid]
+
+class InterProScanTSV(InterProScanTabular):
+    '''Streaming importer for InterProScan 5 tab-separated output:
+       protein, md5, length, analysis, signature, description, start,
+       stop, score, status, date and the optional InterPro accession,
+       InterPro description, GO terms and pathways.
+    '''
+    
+    def __parse_lines__(self, fields):
+        for cols in fields:
+            if len(cols) < 11:
+                continue
+            self.__start_protein__(cols[0], int(cols[2]))
+            ncols = len(cols)
+            self.__add_match__(cols[3], cols[4], cols[5], cols[6], cols[7],
+                    cols[8], cols[9],
+                    ncols > 11 and cols[11] or None,
+                    ncols > 12 and cols[12] or None,
+                    ncols > 13 and split_goids(cols[13]) or [])
+
+class InterProScanGFF3(InterProScanTabular):
+    '''Streaming importer for InterProScan 5 GFF3 output.  Proteins
+       come from 'polypeptide' features and match locations from
+       'protein_match' features; the trailing ##FASTA section is
+       skipped.
+    '''
+    
+    def __parse_lines__(self, fields):
+        for cols in fields:
+            if cols[0].startswith('#'):
+                if cols[0].startswith('##FASTA'):
+                    self.done = True
+                    return
+                continue
+            if len(cols) < 9:
+                continue
+            if cols[2] == 'polypeptide':
+                self.__start_protein__(cols[0], int(cols[4]))
+            elif cols[2] == 'protein_match':
+                self.__start_protein__(cols[0], None)
+                attrs = self.__get_attributes__(cols[8])
+                interpro_id = None
+                for xref in attrs.get('Dbxref', '').split(','):
+                    xref = xref.strip('"')
+                    if xref.startswith('InterPro:'):
+                        interpro_id = xref[len('InterPro:'):]
+                match_id = attrs.get('Name')
+                self.__add_match__(cols[1], match_id,
+                        attrs.get('signature_desc', match_id),
+                        cols[3], cols[4], cols[5], attrs.get('status'),
+                        interpro_id, None,
+                        split_goids(attrs.get('Ontology_term')))
+    
+    def __get_attributes__(self, column):
+        '''Returns: the attributes of a GFF3 feature (dict)
+        '''
+        attrs = {}
+        for attr in column.split(';'):
+            if '=' in attr:
+                key, value = attr.split('=', 1)
+                attrs[key] = urllib.unquote(value)
+        return attrs
+
+# Importers for the line-based formats, by format name
+TABULAR_IMPORTERS = {'tsv':InterProScanTSV, 'gff3':InterProScanGFF3}
+
+def guess_format(filename):
+    '''Guess the format of an InterProScan output file from its
+       extension or first line.
+       Returns: 'xml', 'tsv' or 'gff3' (str)
+    '''
+    name = filename
+    if guess_compression(filename):
+        name = os.path.splitext(filename)[0]
+    extension = os.path.splitext(name)[1].lower()
+    if extension in ('.tsv', '.tab', '.txt'):
+        return 'tsv'
+    elif extension in ('.gff3', '.gff'):
+        return 'gff3'
+    elif extension == '.xml':
+        return 'xml'
+    
+    infile = open_input(filename)
+    line = infile.readline()
+    infile.close()
+    if line.startswith('##gff-version'):
+        return 'gff3'
+    elif len(line.split('\t')) >= 11:
+        return 'tsv'
+    return 'xml'
+
+# Leading bytes of the compressed file formats that can be read
+# directly: (magic, compression)
+COMPRESSION_MAGIC = [('\x1f\x8b', 'gzip'),
+                     ('BZh', 'bz2'),
+                     ('\xfd7zXZ\x00', 'xz')]
+
+def guess_compression(filename):
+    '''Returns: 'gzip', 'bz2' or 'xz' for a compressed file, going by
+       its magic bytes, or None for an uncompressed file (str)
+    '''
+    infile = open(filename, 'rb')
+    magic = infile.read(6)
+    infile.close()
+    for prefix, compression in COMPRESSION_MAGIC:
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+class DecompressedFile:
+    '''Read-only file object that decompresses a gzip, bz2 or xz
+       file while it is read, in blocks of buffer_size compressed
+       bytes.  Files made of several concatenated compressed
+       streams (e.g. from pigz or pbzip2) are read to the end.
+    '''
+    
+    buffer_size = 1 << 20
+    
+    def __init__(self, filename, compression):
+        if compression == 'xz' and lzma is None:
+            raise IOError, "Reading xz files requires the lzma module " + \
+                           "(backports.lzma): " + filename
+        self.name = filename
+        self.compression = compression
+        self.fileobj = open(filename, 'rb')
+        self.decompressor = self.__new_decompressor__()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        
+        # Compressed bytes read so far
+        self.compressed = 0
+    
+    def __new_decompressor__(self):
+        if self.compression == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.compression == 'bz2':
+            return bz2.BZ2Decompressor()
+        return lzma.LZMADecompressor()
+    
+    def __fill__(self):
+        '''Decompress the next block onto the unread data.
+           Returns: False at the end of the file (bool)
+        '''
+        if self.eof:
+            return False
+        data = self.fileobj.read(self.buffer_size)
+        self.compressed += len(data)
+        if not data:
+            self.eof = True
+        
+        chunks = [self.buffer[self.pos:]]
+        while data:
+            try:
+                chunks.append(self.decompressor.decompress(data))
+            except EOFError: # the previous stream ended with the block
+                self.decompressor = self.__new_decompressor__()
+                continue
+            data = self.decompressor.unused_data
+            if data: # another stream follows
+                self.decompressor = self.__new_decompressor__()
+        self.buffer = ''.join(chunks)
+        self.pos = 0
+        return True
+    
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) - self.pos < size) and \
+                self.__fill__():
+            pass
+        if size < 0:
+            size = len(self.buffer) - self.pos
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+    
+    def readline(self):
+        end = self.buffer.find('\n', self.pos)
+        while end < 0 and self.__fill__():
+            end = self.buffer.find('\n', self.pos)
+        if end < 0:
+            return self.read()
+        return self.read(end + 1 - self.pos)
+    
+    def readlines(self, sizehint=-1):
+        while (sizehint < 0 or len(self.buffer) - self.pos < sizehint) and \
+                self.__fill__():
+            pass
+        end = self.buffer.rfind('\n', self.pos) + 1
+        if self.eof or end == 0:
+            end = len(self.buffer)
+        lines = self.buffer[self.pos:end].splitlines(True)
+        self.pos = end
+        return lines
+    
+    def tell_compressed(self):
+        '''Returns: compressed bytes read so far (int)
+        '''
+        return self.compressed
+    
+    def close(self):
+        self.fileobj.close()
+
+def open_input(filename):
+    '''Open an InterProScan output file for reading, decompressing it
+       on the fly if it is compressed.
+       Returns: file object
+    '''
+    compression = guess_compression(filename)
+    if compression:
+        return DecompressedFile(filename, compression)
+    return open(filename, 'rb')
+
+def get_input_position(source):
+    '''Returns: bytes of the input file read so far through a file
+       object from open_input(), counted in compressed bytes for
+       compressed files (int)
+    '''
+    if isinstance(source, DecompressedFile):
+        return source.tell_compressed()
+    try:
+        return source.tell()
+    except (IOError, ValueError): # closed
+        return os.path.getsize(source.name)
+
+# Start of a <protein> element; shards are cut in front of these
+PROTEIN_TAG = re.compile(r'<protein[\s>]')
+PROTEIN_END = '</protein>'
+XML_DECLARATION = re.compile(r'^\s*(<\?xml[^>]*\?>)')
+
+def find_shards(filename, shard_size):
+    '''Scan an InterProScan XML file for <protein> elements and cut
+       it into shards of about shard_size bytes that each start at a
+       <protein> tag.  The last shard ends after the last </protein>.
+       Returns: (xml declaration, [(start, end), ...])
+    '''
+    xmlfile = open(filename, 'rb')
+    starts = []
+    last_end = None
+    next_cut = 0
+    pos = 0
+    tail = ''
+    header = ''
+    while True:
+        chunk = xmlfile.read(1 << 20)
+        if not chunk:
+            break
+        data = tail + chunk
+        base = pos - len(tail)
+        if pos == 0:
+            declaration = XML_DECLARATION.match(data)
+            if declaration:
+                header = declaration.group(1)
+        
+        # Only the first tag past each cut point starts a new shard
+        match = PROTEIN_TAG.search(data, max(0, next_cut - base))
+        while match:
+            starts.append(base + match.start())
+            next_cut = starts[-1] + max(1, shard_size)
+            match = PROTEIN_TAG.search(data, max(0, next_cut - base))
+        
+        end = data.rfind(PROTEIN_END)
+        if end >= 0:
+            last_end = base + end + len(PROTEIN_END)
+        pos += len(chunk)
+        tail = data[-len(PROTEIN_END):]
+    xmlfile.close()
+    
+    if not starts or last_end is None:
+        return header, []
+    return header, zip(starts, starts[1:] + [last_end])
+
+def parse_shard(task):
+    '''Worker process entry point: parse the bytes start:end of an
+       XML file, which hold whole <protein> elements, into rows.
+       Returns: (rows by table, protein marks, matches, proteins,
+                 bytes, seconds)
+    '''
+    filename, header, start, end, backend = task
+    started = time.time()
+    xmlfile = open(filename, 'rb')
+    xmlfile.seek(start)
+    data = xmlfile.read(end - start)
+    xmlfile.close()
+    
+    collector = RowCollector()
+    handler = EBIXML(None, writer=collector)
+    try:
+        parse_xml(StringIO(header + '<shard>' + data + '</shard>'),
+                  handler, backend)
+    except Exception, error:
+        # Parser exceptions hold the parser, which cannot be sent
+        # back to the importing process
+        raise ValueError, "Cannot parse bytes %d to %d of %s: %s" % (
+                    start, end, filename, error)
+    return (collector.rows, collector.marks, handler.pim_id,
+            handler.proteins, len(data), time.time() - started)
+
+def parse_shards(pool, tasks, window):
+    '''Parse shards with a pool of worker processes, keeping at most
+       window of them submitted but not yet taken by the caller, so
+       that the parsed rows waiting for the writer stay bounded.
+       Yields: the results of parse_shard, in the order of tasks
+    '''
+    pending = []
+    for task in tasks:
+        pending.append(pool.apply_async(parse_shard, (task, )))
+        if len(pending) >= window:
+            yield pending.pop(0).get()
+    while pending:
+        yield pending.pop(0).get()
+
+class ResumedXMLFile:
+    '''File object over an InterProScan XML file from open_input()
+       that leaves out its first skip <protein> elements, so that an
+       interrupted import can be parsed again from the first protein
+       it did not commit.  The text in front of the first protein (the
+       XML declaration and root element) and after the skipped ones
+       is kept.  Skipped proteins are only scanned for their tags.
+    '''
+    
+    def __init__(self, source, skip):
+        self.source = source
+        self.buffer = self.__skip__(skip)
+    
+    def __skip__(self, skip):
+        '''Read the source up to the <protein> tag after the
+           skipped ones.
+           Returns: the text to read before the rest of the source (str)
+        '''
+        header = None
+        data = ''
+        pos = 0
+        while True:
+            match = PROTEIN_TAG.search(data, pos)
+            if match:
+                if header is None:
+                    header = data[:match.start()]
+                if not skip:
+                    return header + data[match.start():]
+                skip -= 1
+                pos = match.end()
+                continue
+            
+            # Keep the header, and otherwise only the text after the
+            # last skipped </protein> or the tag being skipped
+            if header is not None:
+                end = data.rfind(PROTEIN_END, pos)
+                if end >= 0:
+                    pos = end + len(PROTEIN_END)
+                data, pos = data[pos:], 0
+            chunk = self.source.read(1 << 20)
+            if not chunk:
+                break
+            data += chunk
+        if header is None:
+            return data
+        return header + data
+    
+    def read(self, size=-1):
+        if self.buffer:
+            if size < 0:
+                data = self.buffer + self.source.read()
             else:
-                dbsettings = self.settings.getlocaldb()
-                os.system("mysql %s -u%s -h %s -p%s < %s" %
-                      (dbsettings.getdb(),
-                       dbsettings.getuser(),
-                       dbsettings.gethost(),
-                       dbsettings.getpasswd(),
-                       self.outfile.name))
-                log = open(os.path.join(self.outpath,'tbl_creation.log'), 'a')
-                log.write(str(time.ctime()) + "\t" + \
-                          self.settings.getsession() + "\n")
+                data = self.buffer[:size]
+                self.buffer = self.buffer[size:]
+                return data
+            self.buffer = ''
+            return data
+        return self.source.read(size)
+    
+    def close(self):
+        self.source.close()
+
+def find_resumable_session(sessionsdir, filenames):
+    '''Returns: id of the most recent session holding an unfinished
+       import of the given file or list of files, or None (str)
+    '''
+    if isinstance(filenames, basestring):
+        filenames = [filenames]
+    sources = '\n'.join([os.path.abspath(filename) for filename in filenames])
+    sessions = []
+    for session in os.listdir(sessionsdir):
+        marker = os.path.join(sessionsdir, session, RESUME_MARKER)
+        try:
+            markerfile = open(marker, 'r')
+            source = markerfile.read().strip()
+            markerfile.close()
+        except IOError:
+            continue
+        if source == sources:
+            sessions.append((os.path.getmtime(marker), session))
+    if not sessions:
+        return None
+    return max(sessions)[1]
+
+def is_resumable(sessiondir):
+    '''Returns: whether the session directory holds an unfinished
+       import (bool)
+    '''
+    return bool(sessiondir) and \
+           os.path.exists(os.path.join(sessiondir, RESUME_MARKER))
 
 class ParseXMLFile(Thread):
-    def __init__(self, filename, settings):
+    '''Thread that parses one or more InterProScan output files into
+       the tables of one session, merging them in the order given.
+       TSV and GFF3 files are handed to their streaming importers.
+       XML files are parsed with EBIXML; with the 'processes' import
+       setting other than 1 they are cut into shards on <protein>
+       boundaries.  One pool of worker processes parses the shards of
+       all the files, working ahead on the next files while this
+       thread writes the rows of the current one in file order, so
+       pim_ids are the same as with a single-threaded parse.  The
+       workers run at most twice as many shards ahead as there are
+       processes, so memory stays bounded by the shard size.
+       Compressed files are decompressed while they are parsed, in
+       this thread.
+       
+       Only this thread writes to the session: each file's pim_ids
+       follow those of the files before it, and proteins imported
+       from an earlier file are left out (see
+       SessionWriter.is_duplicate).
+       
+       While the import runs the session directory holds a
+       RESUME_MARKER file, and every commit records a checkpoint of
+       the file being imported.  With resume set, an import
+       interrupted in the same session skips the files it finished
+       and continues XML files after their last checkpoint; TSV and
+       GFF3 files are read again, leaving out the proteins they had
+       committed.
+    '''
+    
+    def __init__(self, filenames, settings, resume=False):
         Thread.__init__(self)
-        self.filename = filename
+        if isinstance(filenames, basestring):
+            filenames = [filenames]
+        self.filenames = list(filenames)
         self.settings = settings
+        self.resume = resume
+        self.handler = None
+        self.ingested = 0
+        self.source = None
+        self.sizes = [os.path.getsize(filename) for filename in
+                      self.filenames]
+        self.size = sum(self.sizes)
+        self.bytesdone = 0
+        self.bytesread = 0
+        self.error = None
+        
+        # (shard, bytes, proteins, seconds) for each parsed shard
+        self.shardtimes = []
     
     def run(self):
-        # Create a parser
-        parser = make_parser()
-        parser.setFeature(feature_namespaces, 0)
+        '''Import the files.  If the import fails its exception is
+           kept in self.error (see geterror): the worker processes
+           are stopped, the rows not committed are dropped and the
+           RESUME_MARKER is removed, so the session is not offered
+           for resuming.  An import interrupted by anything other
+           than an Exception keeps the marker.
+        '''
+        marker = os.path.join(self.settings.getsessiondir(), RESUME_MARKER)
+        markerfile = open(marker, 'w')
+        for filename in self.filenames:
+            markerfile.write(os.path.abspath(filename) + '\n')
+        markerfile.close()
+        
+        writer = None
+        pool = None
+        try:
+            writer = SessionWriter(self.settings)
+            checkpoints = self.__open_session__(writer)
+            pim_id = writer.get_max_pim_id()
+            
+            # Queue the shards of all sharded files in one pool
+            processes = self.settings.getprocesses()
+            if processes < 1:
+                processes = multiprocessing.cpu_count()
+            modes = []
+            shards = []
+            tasks = []
+            for filename in self.filenames:
+                checkpoint = checkpoints.get(filename)
+                mode = self.__get_mode__(filename, checkpoint)
+                header, fileshards = '', []
+                if mode == 'shards':
+                    header, fileshards = self.__get_shards__(filename,
+                                                             checkpoint)
+                modes.append(mode)
+                shards.append(fileshards)
+                tasks.extend([(filename, header, start, end,
+                               self.settings.getxmlparser())
+                              for start, end in fileshards])
+            results = None
+            if tasks:
+                pool = multiprocessing.Pool(min(processes, len(tasks)))
+                results = parse_shards(pool, tasks, 2 * processes)
+            
+            for index, filename in enumerate(self.filenames):
+                checkpoint = checkpoints.get(filename)
+                writer.set_source(filename)
+                if modes[index] == 'done':
+                    self.ingested += checkpoint['proteins']
+                elif modes[index] == 'shards':
+                    pim_id = self.__merge_shards__(writer, shards[index],
+                                                   results, pim_id,
+                                                   checkpoint)
+                else:
+                    if modes[index] == 'serial':
+                        self.handler = EBIXML(self.settings, writer=writer)
+                        self.__parse__(filename, pim_id, checkpoint)
+                    else:
+                        self.handler = TABULAR_IMPORTERS[modes[index]](
+                                            self.settings, writer=writer)
+                        self.handler.pim_id = pim_id
+                        self.source = open_input(filename)
+                        self.handler.parse(self.source)
+                    pim_id = self.handler.pim_id
+                    self.ingested += self.handler.ingested
+                    self.handler = None
+                writer.finish_source()
+                self.source = None
+                self.bytesdone += self.sizes[index]
+                self.bytesread = self.bytesdone
+            
+            if pool:
+                pool.close()
+                pool.join()
+                print "iprstats: parsed %d shards with %d processes" % (
+                            len(self.shardtimes), processes)
+                for index, nbytes, proteins, elapsed in self.shardtimes:
+                    print "    shard %-5d %12d bytes %9d proteins " \
+                          "%8.2fs" % (index, nbytes, proteins, elapsed)
+                pool = None
+            writer.close()
+            writer = None
+            self.bytesread = self.size
+            os.remove(marker)
+        except Exception:
+            self.error = sys.exc_info()[1]
+            print "iprstats: the import failed: %s" % (self.error)
+            traceback.print_exc()
+            os.remove(marker)
+        finally:
+            # Stop the workers and drop the rows not committed, so a
+            # failed or interrupted import leaves no processes or open
+            # files behind
+            if pool:
+                pool.terminate()
+                pool.join()
+            if writer:
+                writer.abort()
+            if self.source:
+                self.source.close()
+                self.source = None
+    
+    def __open_session__(self, writer):
+        '''Create the session tables or, with resume set, read the
+           checkpoints of the interrupted import in the session.  If
+           there are none, or an input file has changed since, the
+           import starts over.
+           Returns: checkpoints by file name (dict)
+        '''
+        checkpoints = {}
+        if self.resume:
+            for filename, size in zip(self.filenames, self.sizes):
+                checkpoint = writer.get_checkpoint(filename)
+                if checkpoint is None:
+                    continue
+                if checkpoint['size'] != size:
+                    print "iprstats: %s has changed since the import " \
+                          "was interrupted" % (filename)
+                    checkpoints = {}
+                    break
+                checkpoints[filename] = checkpoint
+                if checkpoint['finished']:
+                    print "iprstats: %s was imported before the " \
+                          "interruption" % (filename)
+                else:
+                    print "iprstats: resuming the import of %s after %d " \
+                          "proteins" % (filename, checkpoint['proteins'])
+            if checkpoints:
+                return checkpoints
+            print "iprstats: no checkpoint to resume the import from; " + \
+                  "starting over"
+            writer.drop_tables()
+        writer.create_tables()
+        return checkpoints
+    
+    def __get_mode__(self, filename, checkpoint=None):
+        '''Returns: how to import the file: 'done' if it was imported
+           before the import was interrupted, the name of its tabular
+           format, 'serial' for XML parsed in this thread or 'shards'
+           for XML parsed by the worker processes (str)
+        '''
+        if checkpoint and checkpoint['finished']:
+            return 'done'
+        fileformat = guess_format(filename)
+        if fileformat in TABULAR_IMPORTERS:
+            return fileformat
+        if self.settings.getprocesses() == 1:
+            return 'serial'
+        if guess_compression(filename):
+            print "iprstats: compressed files can't be sharded; " + \
+                  "parsing %s in one process" % (filename)
+            return 'serial'
+        if checkpoint and checkpoint['offset'] is None:
+            print "iprstats: resuming the single-process import of " + \
+                  "%s in one process" % (filename)
+            return 'serial'
+        return 'shards'
+    
+    def __get_shards__(self, filename, checkpoint=None):
+        '''Cut an XML file into shards, leaving out the bytes
+           committed before the checkpoint.
+           Returns: (xml declaration, [(start, end), ...])
+        '''
+        header, shards = find_shards(filename,
+                                     self.settings.getshardsize() << 20)
+        if checkpoint:
+            # Checkpoints are at shard boundaries, which start at a
+            # <protein> tag even if the shard size has changed since
+            offset = checkpoint['offset']
+            shards = [(max(start, offset), end) for start, end in shards
+                      if end > offset]
+        return header, shards
+    
+    def __parse__(self, filename, pim_id, checkpoint=None):
+        '''Parse an XML file in this thread with the configured
+           parser backend, skipping the proteins committed before
+           the checkpoint.
+        '''
+        self.handler.pim_id = pim_id
+        self.source = open_input(filename)
+        source = self.source
+        if checkpoint:
+            self.handler.proteins = checkpoint['proteins']
+            self.handler.ingested = checkpoint['proteins']
+            self.handler.pim_id = checkpoint['pim_id']
+            source = ResumedXMLFile(self.source, checkpoint['proteins'])
+        parse_xml(source, self.handler, self.settings.getxmlparser())
+        self.source.close()
+    
+    def __merge_shards__(self, writer, shards, results, pim_id,
+                         checkpoint=None):
+        '''Write the rows the worker processes parsed from the shards
+           of one XML file, with a checkpoint after each shard.
+           Returns: the highest pim_id of the file (int)
+        '''
+        proteins = 0
+        if checkpoint:
+            proteins = checkpoint['proteins']
+            pim_id = checkpoint['pim_id']
+            self.ingested += proteins
+        for start, end in shards:
+            rows, marks, matches, count, nbytes, elapsed = results.next()
+            self.__merge_rows__(writer, rows, marks, pim_id)
+            writer.checkpoint(proteins + count, pim_id + matches, end)
+            writer.flush()
+            pim_id += matches
+            proteins += count
+            self.ingested += count
+            self.bytesread = self.bytesdone + end
+            self.shardtimes.append((len(self.shardtimes), nbytes, count,
+                                    elapsed))
+        return pim_id
+    
+    def __merge_rows__(self, writer, rows, marks, pim_base):
+        '''Shift the pim_ids of the rows of a shard, which start
+           from 1, past pim_base and write the rows of the proteins
+           that are not duplicates.
+        '''
+        kept = []
+        previous = [0] * len(TABLES)
+        for protein_id, crc64, ends in marks:
+            if not writer.is_duplicate(protein_id, crc64):
+                kept.append((previous, ends))
+            previous = ends
+        for index, (table, _, columns) in enumerate(TABLES):
+            tablerows = rows[table]
+            if len(kept) < len(marks):
+                tablerows = [row for start, end in kept for row in
+                             tablerows[start[index]:end[index]]]
+            if 'pim_id' in columns:
+                col = list(columns).index('pim_id')
+                tablerows = [row[:col] + (row[col] + pim_base,) +
+                             row[col + 1:] for row in tablerows]
+            writer.extend(table, tablerows)
+    
+    def getingested(self):
+        '''Returns: number of proteins committed to the
+           database so far (int)
+        '''
+        if self.handler:
+            return self.ingested + self.handler.ingested
+        return self.ingested
+    
+    def getprogress(self):
+        '''Returns: fraction of the input files read so far, by
+           compressed size for compressed files (float)
+        '''
+        source = self.source
+        if source and self.bytesread < self.size:
+            self.bytesread = self.bytesdone + get_input_position(source)
+        return min(1.0, float(self.bytesread) / max(1, self.size))
+    
+    def geterror(self):
+        '''Returns: the exception that stopped the import, or None
+           if the import finished (Exception)
+        '''
+        return self.error
 
-        # Create the Handler
-        exh = EBIXML(self.settings)
+# Local Gene Ontology term index: a SQLite file that maps GO term
+# accessions to names, used by the 'local' GO backend
+GO_INDEX_TABLE = 'go_term'
 
-        # Parse file into DB
-        parser.setContentHandler(exh)
-        parser.parse(self.filename)
-        del parser
+def read_go_terms(filename):
+    '''Read the terms of a Gene Ontology OBO file (gene_ontology.obo)
+       or tab-separated flat file (GO.terms_and_ids).  Alternative ids
+       of an OBO term are given the term's name, since annotations may
+       still use them.
+       Yields: (accession, name)
+    '''
+    gofile = open(filename, 'rU')
+    stanza = None
+    ids = []
+    name = None
+    for line in gofile:
+        line = line.strip()
+        if line.startswith('['):
+            for acc in ids:
+                yield acc, name
+            stanza = line
+            ids = []
+            name = None
+        elif stanza == '[Term]':
+            key, _, value = line.partition(': ')
+            if key in ('id', 'alt_id'):
+                ids.append(value)
+            elif key == 'name':
+                name = value
+        elif stanza is None and line.startswith('GO:'):
+            fields = line.split('\t')
+            if len(fields) > 1:
+                yield fields[0], fields[1]
+    for acc in ids:
+        yield acc, name
+    gofile.close()
+
+def build_go_index(filename, indexpath):
+    '''Compile a Gene Ontology term file into the SQLite GO term index
+       at indexpath, replacing it once the new index is complete.
+       Returns: number of terms indexed (int)
+    '''
+    started = time.time()
+    temppath = indexpath + '.tmp'
+    if os.path.exists(temppath):
+        os.remove(temppath)
+    
+    db_con = sqlite3.connect(temppath)
+    db_con.execute("""
+        CREATE TABLE `%s`
+            ( `acc` varchar(16) PRIMARY KEY,
+              `name` varchar(255) NOT NULL );""" % (GO_INDEX_TABLE))
+    db_con.executemany("INSERT OR IGNORE INTO `%s` VALUES (?, ?);" %
+                       (GO_INDEX_TABLE),
+                       ((acc, name) for acc, name in read_go_terms(filename)
+                        if name is not None))
+    terms = db_con.execute("SELECT COUNT(1) FROM `%s`;" %
+                           (GO_INDEX_TABLE)).fetchone()[0]
+    db_con.commit()
+    db_con.close()
+    
+    if os.path.exists(indexpath):
+        os.remove(indexpath)
+    os.rename(temppath, indexpath)
+    print "Indexed %d GO terms from %s in %.2fs" % \
+          (terms, filename, time.time() - started)
+    return terms
 
 
 import tarfile
@@ -8,6 +8,7 @@ import wx
 import os
 import shutil
 import webbrowser
+from threading import Thread
 
 import core
 import standalone
@@ -31,6 +32,9 @@ class IPRStats:
 
         self.settings = core.Settings(installed=installed)
         self.iprstat = None
+        self.loader = None
+        self.dialog = None
+        self.stored = None
         
         self.mainframe = standalone.MainFrame(self.settings.getapps(),
                                               None, -1, "")
@@ -52,6 +56,8 @@ class IPRStats:
                             self.mainframe.menu.about)
         self.mainframe.Bind(wx.grid.EVT_GRID_CELL_LEFT_CLICK,
                             self.OnCellLeftClick)
+        self.mainframe.Bind(standalone.EVT_RESULTS_LOADED,
+                            self.OnResultsLoaded)
         
         app.SetTopWindow(self.mainframe)
         app.MainLoop()
@@ -60,54 +66,152 @@ class IPRStats:
         """ Open an XML file
         
         Launches a file-chooser dialog for the user to select the
-        InterProScan output XML file or IPRStats file to be
-        opened.  It then calls the corresponding function to open
-        it and refresh the GUI data.
+        InterProScan output files (XML, TSV or GFF3) or IPRStats file
+        to be opened.  It then calls the corresponding function to open
+        them and refresh the GUI data.  Several InterProScan output
+        files, such as the chunks of a proteome, are opened together
+        in one session.
         """
         filetypes = ["XML (*.xml)|*.xml",
+                     "TSV/GFF3 (*.tsv;*.gff3)|*.tsv;*.gff3",
                      "IPRStats File (*.ips)|*.ips",
                      "View all files (*.*)|*.*"]
         dlg = wx.FileDialog(self.mainframe, "Choose a file",
                             self.settings.getexportdir(), "",
-                            "|".join(filetypes), wx.OPEN)
+                            "|".join(filetypes), wx.OPEN | wx.MULTIPLE)
         if dlg.ShowModal() == wx.ID_OK:
-            filename = dlg.GetFilename()
             self.settings.setexportdir(dlg.GetDirectory())
-            infile = os.path.join(self.settings.getexportdir(), filename)
+            infiles = dlg.GetPaths()
+            sessions = [infile for infile in infiles
+                        if infile[-4:] == '.ips']
             
-            if infile[-4:] != '.ips':
-                self.OpenXMLFile(infile)
+            if not sessions:
+                self.OpenXMLFile(infiles)
             else:
-                self.OpenSession(infile)
+                self.OpenSession(sessions[0])
         dlg.Destroy()
     
-    def OpenXMLFile(self, filename):
-        """Create a new session, parse the XML file, and retrieve
-        the results.
+    def OpenXMLFile(self, filenames):
+        """Create a new session, parse the XML file or list of files
+        into it, and retrieve the results.
+        
+        With the session store enabled, a session imported earlier
+        from files with the same contents is opened instead, and the
+        new session is kept for reuse.  The digests of the files are
+        computed in another thread while the progress dialog is shown.
         """
-        # Create a new session and pass the user-selected XML to the
-        # XML parser
-        self.settings.newsession()
-        parsethread = importers.ParseXMLFile(filename, self.settings)
+        if isinstance(filenames, basestring):
+            filenames = [filenames]
+        if len(filenames) == 1:
+            name = os.path.basename(filenames[0])
+        else:
+            name = '%d files' % (len(filenames))
+        self.CloseData()
+        
+        # Create a progress bar dialog and update it while the files
+        # are read. Reading them cannot be cancelled, but the loading
+        # of the results that follows can.
+        dialog = wx.ProgressDialog('Progress', 'Opening ' + name + '...',
+                             maximum = 2 + len(self.settings.getapps()),
+                             style = wx.PD_AUTO_HIDE | wx.PD_CAN_ABORT)
+        cancelled = False
         
-        # Create a progress bar dialog and update it while the
-        # XML file is still being parsed.
-        dialog = wx.ProgressDialog('Progress',
-                            'Opening ' + os.path.basename(filename) + '...',
-                             maximum = 3 )
+        store = None
+        stored = None
+        if self.settings.usesessionstore():
+            store = core.SessionStore(self.settings)
+            ids = []
+            hasher = Thread(target=lambda: ids.append(
+                                store.get_session_id(filenames)))
+            hasher.start()
+            while hasher.isAlive():
+                wx.MilliSleep(100)
+                if not self.UpdateDialog(dialog, 0, "Checking %s... (%d%% "
+                              "read)" % (name, 100 * store.get_progress())):
+                    cancelled = True
+            hasher.join()
+            if ids:
+                stored = ids[0]
+            if stored and store.open(stored):
+                dialog.Destroy()
+                self.settings.newsession(stored)
+                self.iprstat = core.IPRStatsData(self.settings)
+                store.store(stored)
+                store.close()
+                self.stored = stored
+                self.LoadResults(background=not cancelled)
+                self.EnableExportOptions()
+                return
+        
+        # Offer to resume an earlier import of the same files that was
+        # interrupted, otherwise create a new session and pass the
+        # user-selected XML to the XML parser
+        resume = False
+        session = importers.find_resumable_session(
+                        self.settings.getsessionsdir(), filenames)
+        if session:
+            msg = 'An earlier import of ' + name + \
+                  ' was interrupted.\nDo you want to resume it?'
+            dlg = wx.MessageDialog(self.mainframe, msg, 'Resume import',
+                                   wx.YES_NO | wx.ICON_QUESTION)
+            resume = dlg.ShowModal() == wx.ID_YES
+            dlg.Destroy()
+            if not resume:
+                shutil.rmtree(os.path.join(self.settings.getsessionsdir(),
+                                           session), True)
+        if resume:
+            self.settings.newsession(session)
+        elif stored:
+            # Clear what an unfinished import of the same contents
+            # from other paths left behind
+            shutil.rmtree(os.path.join(self.settings.getsessionsdir(),
+                                       stored), True)
+            self.settings.newsession(stored)
+        else:
+            self.settings.newsession()
+        parsethread = importers.ParseXMLFile(filenames, self.settings,
+                                             resume=resume)
         parsethread.start()
         while parsethread.isAlive():
-            wx.Sleep(0.1)
-            dialog.Update(1, "Parsing XML file...")
+            wx.MilliSleep(100)
+            if not self.UpdateDialog(dialog, 1, "Parsing XML file... %d "
+                          "proteins ingested (%d%% read)" % (
+                          parsethread.getingested(),
+                          100 * parsethread.getprogress())):
+                cancelled = True
         parsethread.join()
         
-        # Query the data parsed by the XML parser and populate
-        # the GUI with it. Update the progress bar dialog.
-        dialog.Update(2, "Retrieving parsed data...")
+        # Tell the user why a failed import stopped and discard what
+        # it wrote, instead of showing the partial session
+        if parsethread.geterror():
+            dialog.Destroy()
+            if store:
+                store.close()
+            msg = 'Cannot import %s:\n%s' % (name, parsethread.geterror())
+            dlg = wx.MessageDialog(self.mainframe, msg, 'Import failed',
+                                   wx.OK | wx.ICON_ERROR)
+            dlg.ShowModal()
+            dlg.Destroy()
+            self.settings.closesession()
+            return
+        
+        # Query the data parsed by the XML parser and load the results
+        # into the GUI in the background, updating the progress bar
+        # dialog as the apps are loaded.
+        if not cancelled:
+            self.UpdateDialog(dialog, 2, "Retrieving parsed data...")
         self.iprstat = core.IPRStatsData(self.settings)
-        self.mainframe.tabbook.UpdateTabs(self.iprstat)
-        dialog.Update(3, "Done!")
-        dialog.Destroy()
+        if store:
+            if self.settings.getsession() == stored and not \
+                    importers.is_resumable(self.settings.getsessiondir()):
+                store.store(stored)
+                self.stored = stored
+            store.close()
+        if cancelled:
+            dialog.Destroy()
+            self.LoadResults(background=False)
+        else:
+            self.LoadResults(dialog)
     
         self.EnableExportOptions()
     
@@ -117,9 +221,10 @@ class IPRStats:
         importips = importers.ips(self.settings.getsessionsdir())
         session = importips.open(filename)
         if session:
+            self.CloseData()
             self.settings.newsession(session)
             self.iprstat = core.IPRStatsData(self.settings)
-            self.mainframe.tabbook.UpdateTabs(self.iprstat)
+            self.LoadResults()
             self.EnableExportOptions()
         else:
             print 'Error opening session.'
@@ -174,13 +279,97 @@ class IPRStats:
                                     filename))
         dlg.Destroy()
     
+    def LoadResults(self, dialog=None, background=True):
+        """Load the results of the open session into the tabs
+        
+        A ResultsLoader loads the results and charts of the apps with
+        a pool of worker threads, the shown tab first, and posts an
+        event to fill each tab once its app is loaded. The other apps
+        are loaded in the background if the cache is set to warm up.
+        The progress dialog, if any, is updated as the apps are loaded
+        and cancels the loading when it is aborted.
+        """
+        self.CloseLoader()
+        self.dialog = dialog
+        
+        def loaded(loader, app, saved):
+            wx.PostEvent(self.mainframe, standalone.ResultsLoadedEvent(
+                                loader=loader, app=app, saved=saved))
+        
+        self.loader = core.ResultsLoader(self.iprstat, loaded)
+        self.mainframe.tabbook.UpdateTabs(self.iprstat, self.loader)
+        if background and self.settings.usecachewarmup():
+            for app in self.settings.getapps():
+                self.loader.load(app)
+        if self.dialog and not self.loader.is_loading():
+            self.dialog.Destroy()
+            self.dialog = None
+    
+    def OnResultsLoaded(self, event):
+        """Fill the tab of an app once its results are loaded and
+        update the progress dialog
+        """
+        if event.loader is not self.loader:
+            return
+        self.mainframe.tabbook.FillTab(event.app, event.saved)
+        done, total = self.loader.get_progress()
+        if done == total == len(self.settings.getapps()):
+            self.UpdateStoredSize()
+        if not self.dialog:
+            return
+        
+        if done < total:
+            if self.UpdateDialog(self.dialog, 2 + done,
+                                 "Loading results... %d of %d apps "
+                                 "loaded" % (done, total)):
+                return
+            self.loader.cancel()
+        self.dialog.Destroy()
+        self.dialog = None
+    
+    def UpdateDialog(self, dialog, value, message):
+        """Update a progress dialog.
+           Returns: False if the user aborted it (bool)
+        """
+        keepgoing = dialog.Update(value, message)
+        if isinstance(keepgoing, tuple):
+            keepgoing = keepgoing[0]
+        return keepgoing
+    
+    def CloseLoader(self):
+        """Cancel the loading of the results, waiting for the apps
+        being loaded, and close its progress dialog
+        """
+        if self.loader:
+            self.loader.cancel()
+            self.loader.join()
+            self.loader = None
+        if self.dialog:
+            self.dialog.Destroy()
+            self.dialog = None
+    
+    def UpdateStoredSize(self):
+        """Record the size of the open session in the session store,
+        if it is kept there, now that its results cache has been built
+        """
+        if self.stored:
+            store = core.SessionStore(self.settings)
+            store.update_size(self.stored)
+            store.close()
+    
+    def CloseData(self):
+        """Stop the background work on the data of the open session
+        """
+        self.CloseLoader()
+        if self.iprstat:
+            self.iprstat.close()
+        self.UpdateStoredSize()
+        self.stored = None
+    
     def OnExit(self, event):
         """Closes the frame, any open files, and database connections. """
-        #self.iprstat.close()
-        try:
-            shutil.rmtree(self.settings.getsessiondir())
-        except:
-            pass
+        self.CloseData()
+        self.settings.closesession()
         
         self.mainframe.Close(True)
         
@@ -194,7 +383,8 @@ class IPRStats:
                             self.settings)
         if dlg.ShowModal() == wx.ID_OK:
             dlg.SaveProperties()
-            self.mainframe.tabbook.UpdateTabs(self.iprstat)
+            if self.iprstat:
+                self.LoadResults()
                 
         dlg.Destroy()
 
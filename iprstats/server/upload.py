@@ -1,13 +1,8 @@
 #!/usr/bin/python
 import cgi, string, os, sys, tempfile
 import cgitb; cgitb.enable()
-import ConfigParser
 from random import choice
-from export_html import export_html
-from ebixml import EBIXML
-from xml.sax import ContentHandler
-from xml.sax import make_parser
-from xml.sax.handler import feature_namespaces
+from iprstats import core, importers, exporters
 try: # Windows needs stdio set for binary mode.
     import msvcrt
     msvcrt.setmode (0, os.O_BINARY) # stdin  = 0
@@ -43,9 +38,8 @@ filepath = save_uploaded_file ("uploadedfile", tempfile.gettempdir())
 
 # Open the configuration file
 try:
-    config = ConfigParser.ConfigParser()
-    config.readfp(open('iprstats.cfg'))
-    exp_dir = config.get('html','directory')
+    settings = core.Settings(configpath='iprstats.cfg')
+    exp_dir = settings.getconfigparser().get('html','directory')
 except:
     print "You must supply a configuration file and a session id.\n"
     sys.exit(2)
@@ -75,17 +69,32 @@ log.write('Opening session ' + session + '...\n')
 log.write('Beginning to parse file ' + os.path.basename(filepath) + '...\n')
 log.flush()
 
-# Create a parser
-parser = make_parser()
+# Open the upload, decompressing it while it is parsed if it was
+# uploaded as a gzip, bz2 or xz file
+source = importers.open_input(filepath)
+filesize = os.path.getsize(filepath)
 
-# Tell the parser we are not interested in XML namespaces
-parser.setFeature(feature_namespaces, 0)
+def log_progress(proteins):
+    """Report the proteins committed so far to the status log."""
+    log.write('%d proteins ingested (%d%% of the file read)...\n' %
+              (proteins, 100 * importers.get_input_position(source) /
+                         max(1, filesize)))
+    log.flush()
 
-# Create the Handler and parse the XML
-exh = EBIXML(session, config=config,outfile=open(os.path.join(tempfile.gettempdir(),session+'.sql'),"w"))
-parser.setContentHandler(exh)
-parser.parse(filepath)
-del parser
+# Create the Handler and parse the XML into the session tables,
+# reporting an import that fails in the status log
+settings.newsession(session)
+try:
+    exh = importers.EBIXML(settings, progress=log_progress)
+    importers.parse_xml(source, exh, settings.getxmlparser())
+except Exception, error:
+    log.write('Error: cannot import ' + os.path.basename(filepath) +
+              ': ' + cgi.escape(str(error)) + '\n')
+    log.close()
+    settings.closesession()
+    sys.exit(1)
+finally:
+    source.close()
 
 log.write('Done parsing file ' + os.path.basename(filepath) + '!\n')
 log.write('Creating HTML...\n')
@@ -95,8 +104,8 @@ exp_dir = os.path.join(exp_dir, session)
 if not os.path.exists(exp_dir): os.mkdir(exp_dir)
 
 # Export the HTML
-eh = export_html(session, config)
-eh.export(directory=exp_dir, chart='google')
+eh = exporters.html(core.IPRStatsData(settings))
+eh.export(directory=exp_dir)
 
 log.write('Done! <a href="runs/'+session+'/gene3d.html">Click here</a>\n')
 log.close()
\ No newline at end of file
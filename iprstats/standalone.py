@@ -2,8 +2,13 @@
 
 import wx
 import wx.grid as gridlib
+import wx.lib.newevent
 import sys
 
+# Posted to the main frame by the worker threads of a ResultsLoader
+# when the results of an app are loaded
+ResultsLoadedEvent, EVT_RESULTS_LOADED = wx.lib.newevent.NewEvent()
+
 
 class MainFrame(wx.Frame): 
     """Top level frame
@@ -97,25 +102,71 @@ class TabBook(wx.Listbook):
         for app in apps:
             self.tabs[app] = TabPanel(self, app)
             self.AddPage(self.tabs[app], app)
+        
+        # Tabs are only updated when they are shown, so the cache
+        # populates the apps that are looked at first
+        self.iprstat = None
+        self.loader = None
+        self.stale = set()
+        self.Bind(wx.EVT_LISTBOOK_PAGE_CHANGED, self.OnPageChanged)
             
-    def UpdateTabs(self, iprstat=None):
-        """Assuming the values have changed, update each tab
-           to display the new data. Return if no new data.
+    def UpdateTabs(self, iprstat=None, loader=None):
+        """Assuming the values have changed, update the shown tab
+           to display the new data, and the others once they are
+           shown. Return if no new data.
+           
+           With a ResultsLoader, the results of the tabs are loaded
+           by its worker threads and filled in with FillTab once
+           they are loaded.
         """
         if not iprstat:
             return
         
-        for app, tab in self.tabs.iteritems():
-            bitmap = iprstat.chart[app].GetChart()
-            if bitmap:
-                tab.chart.SetBitmap(bitmap)
-                tab.chart.Show()
-            else:
-                tab.chart.Hide()
+        self.iprstat = iprstat
+        self.loader = loader
+        self.stale = set(self.tabs.keys())
+        if self.GetSelection() >= 0:
+            self.UpdateTab(self.GetPage(self.GetSelection()))
+    
+    def UpdateTab(self, tab):
+        """Update a tab to display the data of its app, or have the
+           loader load it ahead of the other apps
+        """
+        if tab.app not in self.stale:
+            return
+        if self.loader:
+            self.loader.load(tab.app, first=True)
+        else:
+            self.FillTab(tab.app, self.iprstat.chart[tab.app].Save())
+    
+    def FillTab(self, app, saved):
+        """Fill the tab of an app with its chart, if it was saved,
+           and its results
+        """
+        if app not in self.stale:
+            return
+        self.stale.discard(app)
+        tab = self.tabs[app]
+        
+        bitmap = None
+        if saved:
+            bitmap = self.iprstat.chart[app].GetBitmap()
+        if bitmap:
+            tab.chart.SetBitmap(bitmap)
+            tab.chart.Show()
+        else:
+            tab.chart.Hide()
 
-            tab.grid.GetTable().Update(iprstat.cache)
-            tab.grid.AutoSizeColumns()
-            tab.grid.Fit()
+        tab.grid.GetTable().Update(self.iprstat.cache)
+        tab.grid.AutoSizeColumns()
+        tab.grid.Fit()
+        tab.Layout()
+    
+    def OnPageChanged(self, event):
+        """Update a tab that has become stale when it is shown
+        """
+        self.UpdateTab(self.GetPage(event.GetSelection()))
+        event.Skip()
 
 class Menu(wx.MenuBar):
     """Main menu bar object used by iprstats.py"""
@@ -169,6 +220,11 @@ class Menu(wx.MenuBar):
 class LinkTable(gridlib.PyGridTableBase):
     """Class underlying wx.grid.Grid that stores only the data from
     visible cells in memory at a given time
+    
+    Rows are read from the cache in blocks of 'grid_block_size' rows
+    with one range query, and the 'grid_cache_blocks' most recently
+    used blocks are kept, so repainting and scrolling only query the
+    cache when a new block comes into view.
     """
 
     def __init__(self, app, data=None):
@@ -186,6 +242,63 @@ class LinkTable(gridlib.PyGridTableBase):
         
         self.length = None
         
+        # Row blocks by block number and block numbers from least
+        # to most recently used
+        self.blocks = {}
+        self.lru = []
+        self.hits = 0
+        self.misses = 0
+    
+    def GetRow(self, row):
+        """Retrieve a URL-resolved row from the block cache, reading
+        the block around it from the cache object on a miss
+        
+        Returns (dbname, count, goid, dbid, goname, url, gourl)
+        or None
+        """
+        settings = self.data.settings
+        blocksize = max(1, settings.getgridblocksize())
+        block = row // blocksize
+        
+        rows = self.blocks.get(block)
+        if rows is None:
+            self.misses += 1
+            if self.length is None:
+                self.GetNumberRows()
+            start = block * blocksize
+            rows = self.data.get_rows(self.app, start,
+                                      min(start + blocksize, self.length))
+            self.blocks[block] = rows
+            self.lru.append(block)
+            while len(self.lru) > max(1, settings.getgridcacheblocks()):
+                del self.blocks[self.lru.pop(0)]
+        else:
+            self.hits += 1
+            if self.lru[-1] != block:
+                self.lru.remove(block)
+                self.lru.append(block)
+        
+        if row - block * blocksize < len(rows):
+            return rows[row - block * blocksize]
+        return None
+    
+    def GetCacheStats(self):
+        """Return the block cache statistics as
+        (hits, misses, cached blocks)
+        """
+        return self.hits, self.misses, len(self.blocks)
+    
+    def ClearCache(self):
+        """Drop the cached row blocks and log the statistics"""
+        
+        if self.hits or self.misses:
+            print '%s grid cache: %d hits, %d misses, %d blocks' % (
+                            (self.app,) + self.GetCacheStats())
+        self.blocks = {}
+        self.lru = []
+        self.hits = 0
+        self.misses = 0
+        
     def GetAttr(self, row, col, kind):
         """Return styling attributes for a cell
         
@@ -193,7 +306,8 @@ class LinkTable(gridlib.PyGridTableBase):
         isn't None; make everything readonly
         """
         attr = gridlib.GridCellAttr()
-        if col == 0 and self.data.get_url(self.app, row) != None:
+        record = self.GetRow(row)
+        if col == 0 and record and record[5] != None:
             attr = self.link
         elif col == 2 and self.GetValue(row, col) != "None":
             attr = self.link
@@ -232,10 +346,13 @@ class LinkTable(gridlib.PyGridTableBase):
     def GetValue(self, row, col):
         """Retrieve cell value from the cache object"""
         
+        record = self.GetRow(row)
+        if not record: return None
+        
         if self.data.settings.usegolookup() and col==2:
-            cell = self.data.get_one_cell(self.app, row, col+2)
+            cell = record[col+2]
         else:
-            cell = self.data.get_one_cell(self.app, row, col)
+            cell = record[col]
             
         if not cell: return None
         return cell
@@ -253,6 +370,7 @@ class LinkTable(gridlib.PyGridTableBase):
         
         if data:
             self.data = data
+        self.ClearCache()
         
         self.GetView().BeginBatch()
         newlength = self.data.get_match_length(self.app)
@@ -352,11 +470,10 @@ class PropertiesDlg(wx.Dialog):
         if sys.modules.has_key('MySQLdb'):
             self.LDBUseSqliteChk.SetValue(
                     self.settings.usesqlite())
-            self.GDBGoLookupChk.SetValue(
-                    self.settings.usegolookup())
         else:
             self.LDBUseSqliteChk.SetValue(True)
-            self.GDBGoLookupChk.SetValue(False)
+        self.GDBGoLookupChk.SetValue(
+                self.settings.usegolookup() and self.__go_backend_avail())
         
         # Disable MySQL connection inputs if using SQLite
         if self.LDBUseSqliteChk.GetValue():
@@ -555,10 +672,18 @@ class PropertiesDlg(wx.Dialog):
                 self.LDBPasswrdTxt.Enable()
                 self.LDBPortSpn.Enable()
 
+    def __go_backend_avail(self):
+        """Whether GO terms can be looked up: the local GO term
+        index needs no MySQLdb
+        """
+        return sys.modules.has_key('MySQLdb') or \
+               self.settings.getgobackend() == 'local'
+
     def OnGoLookup(self, event):
         """Disables gene ontology lookup if MySQLdb is not installed
+        and the local GO term index is not used
         """
-        if not sys.modules.has_key('MySQLdb') and \
+        if not self.__go_backend_avail() and \
             self.GDBGoLookupChk.GetValue():
             self.GDBGoLookupChk.SetValue(False)
             msg = 'You must have MySQLdb installed\nto use GO lookup.'
@@ -0,0 +1,172 @@
+'''Checks the bulk GO term name lookup of Cache.__go_names__ against
+   a SQLite stand-in for the term and term_definition tables of the
+   GO MySQL database.
+'''
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from threading import local
+
+PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'iprstats')
+sys.path.insert(0, PACKAGE)
+
+import core
+
+class GOCursor:
+    '''MySQLdb-like cursor over the stand-in GO database that records
+       the parameters of its queries.
+    '''
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.db.cursor()
+    
+    def execute(self, statement, params=()):
+        if self.conn.failing:
+            raise RuntimeError('GO server has gone away')
+        self.conn.queries.append(list(params))
+        return self.cursor.execute(statement.replace('%s', '?'), params)
+    
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class GOConnection:
+    '''MySQLdb-like connection to the stand-in GO database; every
+       query of a failing connection raises.
+    '''
+    
+    def __init__(self, filename, queries, failing=False):
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.queries = queries
+        self.failing = failing
+    
+    def cursor(self):
+        return GOCursor(self)
+    
+    def close(self):
+        self.db.close()
+
+class GOCache(core.Cache):
+    '''Cache that only looks GO terms up, over the given stand-in
+       connections.
+    '''
+    
+    def __init__(self, settings, connections):
+        self.settings = settings
+        self.threads = local()
+        self.gonames = {}
+        self.connections = list(connections)
+        self.go_conn = self.connections.pop(0)
+    
+    def __get_mysql_conn__(self, dbsettings):
+        return self.connections.pop(0)
+
+class GONamesTest(unittest.TestCase):
+    
+    terms = 40
+    
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(PACKAGE, 'data'),
+                        os.path.join(self.tempdir, 'data'))
+        os.chdir(self.tempdir)
+        
+        self.settings = core.Settings()
+        self.settings.gobackend = 'mysql'
+        self.settings.gobatchsize = 4
+        self.settings.goconnections = 3
+        self.settings.gonamecache = os.path.join(self.tempdir,
+                                                 'go_names.db')
+        
+        # Every seventh term has no definition, so the join leaves
+        # it out like a term the GO database does not know
+        self.godb = os.path.join(self.tempdir, 'go.db')
+        conn = sqlite3.connect(self.godb)
+        conn.execute('create table term ( id integer primary key, '
+                     'acc varchar(10), name varchar(255) )')
+        conn.execute('create table term_definition ( term_id integer, '
+                     'term_definition text )')
+        for n in range(1, self.terms + 1):
+            conn.execute('insert into term values (?, ?, ?)',
+                         (n, 'GO:%07d' % n, 'GO term %d' % n))
+            if n % 7:
+                conn.execute('insert into term_definition values (?, ?)',
+                             (n, 'Definition %d' % n))
+        conn.commit()
+        conn.close()
+        
+        # Ids of terms that exist and one that does not
+        self.go_ids = ['GO:%07d' % n for n in range(1, self.terms + 2)]
+        self.queries = []
+    
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir, True)
+    
+    def get_cache(self, failing=()):
+        '''Returns: GOCache with a stand-in connection for each of
+           the 'connections' setting, failing where given (GOCache)
+        '''
+        return GOCache(self.settings,
+                       [GOConnection(self.godb, self.queries, n in failing)
+                        for n in range(self.settings.getgoconnections())])
+    
+    def get_single_names(self):
+        '''Returns: the name of each term id looked up on its own
+           with the single-term join of __go_name__ (dict)
+        '''
+        cache = self.get_cache()
+        cache.go_cursor = cache.go_conn.cursor()
+        return dict([(go_id, cache.__go_name__(go_id))
+                     for go_id in self.go_ids])
+    
+    def get_cached_names(self):
+        '''Returns: the names kept in the persistent GO name cache
+           (dict)
+        '''
+        conn = sqlite3.connect(self.settings.getgonamecache())
+        names = dict(conn.execute('select acc, name from `go_name`'))
+        conn.close()
+        return names
+    
+    def test_batches(self):
+        names = self.get_cache().__go_names__(self.go_ids)
+        size = self.settings.getgobatchsize()
+        self.assertEqual(len(self.queries),
+                         (len(self.go_ids) + size - 1) // size)
+        self.assertEqual(sorted(sum(self.queries, [])), self.go_ids)
+        for params in self.queries:
+            self.assertTrue(len(params) <= size)
+        self.assertEqual(sorted(names), self.go_ids)
+    
+    def test_names(self):
+        names = self.get_cache().__go_names__(self.go_ids)
+        single = self.get_single_names()
+        self.assertEqual(names, single)
+        self.assertEqual(names['GO:0000001'], 'GO term 1')
+        self.assertEqual(names['GO:0000007'], None)
+        self.assertEqual(names['GO:%07d' % (self.terms + 1)], None)
+        self.assertEqual(self.get_cached_names(), single)
+    
+    def test_failing_connection(self):
+        # Batches of the failing connection go to the others; any
+        # that are left over must not be taken for unknown terms
+        names = self.get_cache(failing=[1]).__go_names__(self.go_ids)
+        single = self.get_single_names()
+        for go_id, name in names.items():
+            self.assertEqual(name, single[go_id])
+        self.assertEqual(self.get_cached_names(), names)
+    
+    def test_failing_server(self):
+        failing = range(self.settings.getgoconnections())
+        names = self.get_cache(failing=failing).__go_names__(self.go_ids)
+        self.assertEqual(names, {})
+        self.assertEqual(self.get_cached_names(), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+'''Checks that the Cache aggregate queries are answered from the
+   secondary indexes of the session tables (importers.INDEXES).
+'''
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from threading import local
+
+PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'iprstats')
+sys.path.insert(0, PACKAGE)
+
+import core
+import importers
+
+PROTEIN = '''
+ <protein id="P%(n)07d" length="%(length)d" crc64="%(n)016X">
+  <interpro id="IPR%(ipr)06d" name="Entry %(ipr)d" type="Domain">
+   <match id="PF%(pf)05d" name="PFAM name %(pf)d" dbname="PFAM">
+    <location start="1" end="50" score="1e-5" status="T" evidence="HMMPfam" />
+   </match>
+   <match id="PR%(pr)05d" name="PRINTS name %(pr)d" dbname="PRINTS">
+    <location start="60" end="90" score="." status="T" evidence="FPrintScan" />
+   </match>
+   <classification id="GO:%(go)07d" class_type="GO">
+    <category>Molecular Function</category>
+   </classification>
+  </interpro>
+ </protein>'''
+
+class QueryRecorder:
+    '''Cursor that remembers the statements run through it.
+    '''
+    
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = []
+    
+    def execute(self, statement, *args):
+        self.statements.append(statement)
+        return self.cursor.execute(statement, *args)
+    
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class QueryCache(core.Cache):
+    '''Cache that only runs its queries against a session database.
+    '''
+    
+    def __init__(self, settings, dbpath):
+        self.settings = settings
+        self.threads = local()
+        self.db_conn = sqlite3.connect(dbpath)
+        self.db_cursor = QueryRecorder(self.db_conn.cursor())
+
+class QueryPlanTest(unittest.TestCase):
+    
+    apps = ['PFAM', 'PRINTS']
+    
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(PACKAGE, 'data'),
+                        os.path.join(self.tempdir, 'data'))
+        os.chdir(self.tempdir)
+        
+        self.settings = core.Settings()
+        self.settings.sqlite = True
+        self.settings.processes = 1
+        self.settings.newsession()
+        xmlpath = os.path.join(self.tempdir, 'small.xml')
+        xmlfile = open(xmlpath, 'w')
+        xmlfile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<interpro_matches>')
+        for n in range(200):
+            xmlfile.write(PROTEIN % {'n':n, 'length':100 + n, 'ipr':n % 17,
+                                     'pf':n % 23, 'pr':n % 29, 'go':n % 31})
+        xmlfile.write('\n</interpro_matches>\n')
+        xmlfile.close()
+        importers.ParseXMLFile([xmlpath], self.settings).run()
+        
+        dbpath = os.path.join(self.settings.getsessiondir(),
+                              self.settings.getlocaldb().getdb())
+        self.cache = QueryCache(self.settings, dbpath)
+    
+    def tearDown(self):
+        self.cache.db_conn.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir, True)
+    
+    def get_plan(self, query):
+        '''Run a Cache query method and explain the last statement
+           it ran.
+           Returns: details of the query plan steps (list of str)
+        '''
+        query(self.apps)
+        statement = self.cache.db_cursor.statements[-1]
+        return [row[-1] for row in self.cache.db_conn.execute(
+                        "EXPLAIN QUERY PLAN " + statement)]
+    
+    def assertIndexed(self, plan, indexes):
+        '''Fail unless the plan uses each of the given session
+           indexes and reads no session table without an index.
+        '''
+        session = self.settings.getsession()
+        for index in indexes:
+            self.assertTrue([step for step in plan
+                             if '%s_%s' % (session, index) in step],
+                            "index %s not used: %s" % (index, plan))
+        for step in plan:
+            self.assertFalse(step.startswith('SCAN') and session in step
+                             and 'INDEX' not in step,
+                             "full table scan: %s" % (step))
+    
+    def test_count_query(self):
+        plan = self.get_plan(self.cache.__count_query__)
+        self.assertIndexed(plan, ['iprmatch_db_name'])
+    
+    def test_match_query(self):
+        plan = self.get_plan(self.cache.__match_query__)
+        self.assertIndexed(plan, ['iprmatch_db_name',
+                                  'protein_classification_protein'])
+
+if __name__ == '__main__':
+    unittest.main()
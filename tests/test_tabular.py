@@ -0,0 +1,79 @@
+'''Checks that InterProScan TSV files whose protein rows are split
+   apart are rejected by ParseXMLFile with a message telling the user
+   to sort them, instead of being opened as a partial session.
+'''
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'iprstats')
+sys.path.insert(0, PACKAGE)
+
+import core
+import importers
+
+ROW = '\t'.join(['P%(n)07d', 'abc', '%(length)d', 'Pfam', 'PF%(pf)05d',
+                 'PFAM name %(pf)d', '%(start)d', '%(end)d', '1e-5', 'T',
+                 '01-01-2020', 'IPR%(ipr)06d', 'Entry %(ipr)d',
+                 'GO:%(go)07d']) + '\n'
+
+class SplitProteinTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(PACKAGE, 'data'),
+                        os.path.join(self.tempdir, 'data'))
+        os.chdir(self.tempdir)
+        
+        self.settings = core.Settings()
+        self.settings.sqlite = True
+        self.settings.processes = 1
+        self.settings.newsession()
+    
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir, True)
+    
+    def write_tsv(self, proteins):
+        '''Write a TSV file with two match rows for each protein
+           number given, in that order.
+           Returns: path of the file (str)
+        '''
+        tsvpath = os.path.join(self.tempdir, 'matches.tsv')
+        tsvfile = open(tsvpath, 'w')
+        for n in proteins:
+            for start in (1, 60):
+                tsvfile.write(ROW % {'n':n, 'length':100 + n, 'pf':n % 7,
+                                     'start':start, 'end':start + 40,
+                                     'ipr':n % 5, 'go':n % 3})
+        tsvfile.close()
+        return tsvpath
+    
+    def run_import(self, proteins):
+        thread = importers.ParseXMLFile([self.write_tsv(proteins)],
+                                        self.settings)
+        thread.start()
+        thread.join()
+        return thread
+    
+    def test_sorted_file(self):
+        thread = self.run_import([1, 2, 3])
+        self.assertEqual(thread.geterror(), None)
+        self.assertEqual(thread.getingested(), 3)
+    
+    def test_split_protein(self):
+        thread = self.run_import([1, 2, 1, 3])
+        error = thread.geterror()
+        self.assertTrue(isinstance(error, ValueError), repr(error))
+        self.assertTrue('P0000001' in str(error), str(error))
+        self.assertTrue('sort the file by protein' in str(error),
+                        str(error))
+        self.assertFalse(importers.is_resumable(
+                                self.settings.getsessiondir()))
+
+if __name__ == '__main__':
+    unittest.main()